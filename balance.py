@@ -1,7 +1,13 @@
+import datetime
+from io import BytesIO
 from typing import Dict
-from telegram.update import Update
-from requests import ConnectionError, Timeout
+from telegram import Update
+import blocking
 import exchange
+import rates
+import render
+from ledger import get_ledger
+from transaction import transaction
 
 
 class InvalidBalanceQuery(Exception):
@@ -10,25 +16,74 @@ class InvalidBalanceQuery(Exception):
 
 
 def get_balance() -> int:
-    """Getting current balance or throw IOError if file doesn't exist yet"""
+    """Getting current balance or throw IOError if it isn't set yet"""
 
-    with open("balance.txt", "r") as f:
-        balance = f.read()
-    return int(balance)
+    return get_ledger().balance
 
 
 def set_balance(new_balance: int) -> None:
     """Overriding (or creating) balance by a new value"""
-    with open("balance.txt", "w") as f:
-        f.write(f"{new_balance}")
+    # Same lock as expenses and deletes take, so the balance can't be set halfway through them,
+    # the fsync is awaited after it's released
+    with transaction("balance"):
+        get_ledger().set(new_balance, wait=False)
+    wait_for_balance()
 
 
-def convert_balance(message: str, API_KEY: str) -> Dict:
+def change_balance(delta: int, reason: str, wait: bool = True) -> int:
+    """
+    Adding delta to the balance and getting the new one, or throw IOError if it isn't set yet.
+    Without waiting the change isn't durable until wait_for_balance() returns.
+    """
+    with transaction("balance"):
+        new_balance = get_ledger().change(delta, reason, wait=False)
+    if wait:
+        wait_for_balance()
+    return new_balance
+
+
+def wait_for_balance() -> None:
+    """Block until every balance change made so far is durable"""
+    get_ledger().wait()
+
+
+def start_of_day(day: datetime.date) -> float:
+    """Timestamp of the local midnight the day starts with"""
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+
+def balance_on(day: datetime.date) -> int | None:
+    """Balance at the end of the day or None if it wasn't set by then"""
+    return get_ledger().balance_at(start_of_day(day + datetime.timedelta(days=1)))
+
+
+def daily_balances(month: str) -> dict[str, int]:
+    """Balance at the end of every day of the month up to today, days before the balance was set are skipped"""
+    year, month_number = [int(x) for x in month.split(".")]
+    first_day = datetime.date(year, month_number, 1)
+    next_month = (first_day + datetime.timedelta(days=32)).replace(day=1)
+    balance, entries = get_ledger().history(start_of_day(first_day), start_of_day(next_month))
+
+    daily = {}
+    day = first_day
+    position = 0
+    while day < next_month and day <= datetime.date.today():
+        day_end = start_of_day(day + datetime.timedelta(days=1))
+        while position < len(entries) and entries[position]["time"] < day_end:
+            balance = entries[position]["balance"]
+            position += 1
+        if balance is not None:
+            daily[day.strftime("%Y.%m.%d")] = balance
+        day += datetime.timedelta(days=1)
+    return daily
+
+
+async def convert_balance(message: str, API_KEY: str) -> Dict:
     """Converting balance to another currency"""
     command, currency = message.split()
-    balance = get_balance()
+    balance = await blocking.run(get_balance)
     query = exchange.Exchange_Query("UAH", currency.upper(), balance)
-    result_obj = query.convert(API_KEY)
+    result_obj = await query.convert(API_KEY)
     base_symbol = "₴"
     try:
         target_symbol = f"{exchange.symbols[query.to_currency]}"
@@ -40,12 +95,20 @@ def convert_balance(message: str, API_KEY: str) -> Dict:
         "base_symbol": base_symbol,
         "target_symbol": target_symbol,
         "conversion_rate": conversion_rate,
-        "conversion_result": conversion_result
+        "conversion_result": conversion_result,
+        "balance": balance,
+        "freshness": result_obj["freshness"]
     }
 
 
 def get_type_of_balance_query(message: str) -> str:
     words = message.split()
+    if len(words) == 3 and words[1] in ["history", "история"]:
+        try:
+            datetime.datetime.strptime(words[2], "%Y.%m")
+            return "history"
+        except ValueError:
+            raise InvalidBalanceQuery
     if len(words) > 2:
         raise InvalidBalanceQuery
     if len(words) == 2:
@@ -56,34 +119,72 @@ def get_type_of_balance_query(message: str) -> str:
             return "set"
         except ValueError:
             pass
+        try:
+            datetime.datetime.strptime(words[1], "%Y.%m.%d")
+            return "on_date"
+        except ValueError:
+            pass
     if len(words) == 1:
         return "get"
     raise InvalidBalanceQuery
 
 
-def handle_balance_query(update: Update, API_KEY: str) -> None:
+async def handle_balance_query(update: Update, API_KEY: str) -> None:
     """Send, set new, or convert balance to another currency depending on the command syntax"""
     try:
         query_type = get_type_of_balance_query(update.message.text)
         # Getting
         if query_type == "get":
             try:
-                balance = get_balance()
-                update.message.reply_text(f"🌠 Баланс: {balance} грн")
+                balance = await blocking.run(get_balance)
+                await update.message.reply_text(f"🌠 Баланс: {balance} грн")
             except IOError:
-                update.message.reply_text(
+                await update.message.reply_text(
                     "Баланс еще не определен.\nСначала определите его (bl {число}).")
         # Updating
         if query_type == "set":
             new_balance = int(update.message.text.split()[1])
-            set_balance(new_balance)
-            update.message.reply_text(f"⚡️ Баланс: {new_balance} грн")
+            await blocking.run(set_balance, new_balance)
+            await update.message.reply_text(f"⚡️ Баланс: {new_balance} грн")
+        # Balance at the end of the given day
+        if query_type == "on_date":
+            date = update.message.text.split()[1]
+            balance = await blocking.run(balance_on, datetime.datetime.strptime(date, "%Y.%m.%d").date())
+            if balance is None:
+                await update.message.reply_text(f"Баланс на {date} еще не был определен.")
+            else:
+                await update.message.reply_text(f"🌠 Баланс на {date}: {balance} грн")
+        # Chart of the balance during the month
+        if query_type == "history":
+            month = update.message.text.split()[2]
+            daily = await blocking.run(daily_balances, month)
+            if not daily:
+                await update.message.reply_text(f"Баланс в {month} еще не был определен.")
+                return
+            await reply_balance_chart(update, month, daily)
         # Converting
         if query_type == "convert":
-            result_obj = convert_balance(update.message.text, API_KEY)
+            result_obj = await convert_balance(update.message.text, API_KEY)
             # result_obj["base_symbol"]
-            update.message.reply_text(f"{result_obj['base_symbol']}{get_balance()} = {result_obj['target_symbol']}{float(result_obj['conversion_result']):.2f}" + f" ({result_obj['base_symbol']}1 = {result_obj['target_symbol']}{float(result_obj['conversion_rate'])})")
+            await update.message.reply_text(f"{result_obj['base_symbol']}{result_obj['balance']} = {result_obj['target_symbol']}{float(result_obj['conversion_result']):.2f}" + f" ({result_obj['base_symbol']}1 = {result_obj['target_symbol']}{float(result_obj['conversion_rate'])})\n{result_obj['freshness']}")
     except InvalidBalanceQuery:
-        update.message.reply_text("❌ Ошибка в записи запроса")
-    except (ConnectionError, Timeout):
-        update.message.reply_text("❌ Ошибка при подключении к API курсов валют. Попробуйте позже.")
\ No newline at end of file
+        await update.message.reply_text("❌ Ошибка в записи запроса")
+    except rates.RatesUnavailable:
+        await update.message.reply_text("❌ Ошибка при подключении к API курсов валют. Попробуйте позже.")
+
+
+async def reply_balance_chart(update: Update, month: str, daily: dict[str, int]) -> None:
+    """Show a placeholder until the balance chart is rendered, then replace it by the chart"""
+    placeholder = await update.message.reply_text("⏳ График готовится…")
+    try:
+        chart = await render.run(render.balance_chart, month, daily)
+    except render.RenderQueueFull:
+        await placeholder.edit_text("❌ Слишком много отчетов в очереди. Попробуйте позже.")
+        return
+    except Exception:
+        await placeholder.edit_text("❌ Не удалось построить график. Попробуйте позже.")
+        raise
+
+    await placeholder.delete()
+    days = list(daily)
+    await update.message.reply_photo(photo=BytesIO(chart), caption=f"🌠 Баланс: {daily[days[0]]} грн ({days[0]}) → {daily[days[-1]]} грн ({days[-1]})")
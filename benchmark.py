@@ -0,0 +1,281 @@
+"""
+Micro-benchmarks for the storage and reporting hot paths.
+Every benchmark runs in a temporary directory, so real data is never touched.
+
+Usage: python benchmark.py {name}
+"""
+import datetime
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+import rollups
+from expenses import Expense
+from storage import path_of_month
+
+
+def fill_month(month: str, rows: int) -> None:
+    """Write {rows} synthetic expenses into expenses/{month}.csv"""
+    os.makedirs("expenses", exist_ok=True)
+    categories = ["Еда", "Такси", "Кафе", "Другое"]
+    with open(path_of_month(month), "w", encoding="utf8") as f:
+        f.write("Номер|Дата|Сумма|Категория|Описание\n")
+        for i in range(1, rows + 1):
+            f.write(f"{i}|{month}.{i % 28 + 1:02}|{i % 997 + 1}|{categories[i % 4]}|Описание {i}\n")
+
+
+def bench_append() -> None:
+    """Per-append latency of db.add_expense for months of growing size"""
+    month = db.fixed_month(datetime.date.today())
+    expense = Expense(month + ".01", 100, "Еда", "Хлеб")
+    appends = 500
+
+    print(f"{'rows':>8} {'us/append':>10}")
+    for rows in (1_000, 10_000, 100_000):
+        fill_month(month, rows)
+        db.get_storage().forget_month_file(month)
+        rollups.rebuild(month)
+
+        # The first append opens the file and seeks its tail once per process
+        db.add_expense(expense)
+        start = time.perf_counter()
+        for _ in range(appends):
+            db.add_expense(expense)
+        elapsed = time.perf_counter() - start
+        print(f"{rows:>8} {elapsed / appends * 1e6:>10.1f}")
+
+
+def month_stat_iterrows(month: str) -> dict:
+    """Previous implementation of db.month_stat, kept as the baseline for comparison"""
+    import pandas as pd
+    df = pd.read_csv(path_of_month(month), sep="|")
+    total = 0
+    for index, row in df.iterrows():
+        total += row["Сумма"]
+    sorted_df = df.sort_values("Сумма", ascending=False, inplace=False)
+    sorted_notnull_df = sorted_df.where(pd.notnull(sorted_df), "")
+    biggest_expenses = [sorted_notnull_df.iloc[i] for i in range(5)]
+    each_category_total = {cat: 0 for cat in db.get_storage().load_categories()}
+    for index, row in df.iterrows():
+        each_category_total[row["Категория"]] += row["Сумма"]
+    return {"total": total, "biggest_expenses": biggest_expenses, "each_category_total": each_category_total}
+
+
+def bench_month_stat() -> None:
+    """Previous iterrows month_stat against the vectorized rollup rebuild and db.month_stat"""
+    month = "2020.01"
+    db.get_storage().save_categories({name: [name.lower()] for name in ["Еда", "Такси", "Кафе", "Другое"]})
+
+    print(f"{'rows':>8} {'iterrows, ms':>13} {'vectorized, ms':>15} {'rollup, ms':>11}")
+    for rows in (1_000, 10_000, 100_000):
+        fill_month(month, rows)
+        timings = []
+        for month_stat in (month_stat_iterrows, rollups.rebuild, db.month_stat):
+            start = time.perf_counter()
+            month_stat(month)
+            timings.append((time.perf_counter() - start) * 1e3)
+        print(f"{rows:>8} {timings[0]:>13.1f} {timings[1]:>15.1f} {timings[2]:>11.2f}")
+
+
+def bench_range_stat() -> None:
+    """db.range_stat over three years of 3k-row months, with and without rollups on disk"""
+    db.get_storage().save_categories({name: [name.lower()] for name in ["Еда", "Такси", "Кафе", "Другое"]})
+    for month in db.months_between("2020.01", "2022.12"):
+        fill_month(month, 3_000)
+
+    for state in ("cold", "warm"):
+        start = time.perf_counter()
+        db.range_stat("2020.01", "2022.12")
+        print(f"{state}: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+
+def bench_month_cache() -> None:
+    """Reading a closed month from csv against reading it from the columnar cache"""
+    month = "2020.01"
+    storage = db.get_storage()
+
+    print(f"{'rows':>8} {'csv, ms':>8} {'cache, ms':>10}")
+    for rows in (1_000, 10_000, 100_000):
+        fill_month(month, rows)
+        timings = []
+        # The first read parses the csv and compiles the cache, the second one hits it
+        for _ in range(2):
+            start = time.perf_counter()
+            storage.month_frame(month)
+            timings.append((time.perf_counter() - start) * 1e3)
+        print(f"{rows:>8} {timings[0]:>8.1f} {timings[1]:>10.1f}")
+
+
+def bench_balance() -> None:
+    """Rewriting balance.txt on every change against the ledger with fsync per change and with group commit"""
+    import threading
+    import ledger
+
+    changes, threads = 200, 8
+
+    start = time.perf_counter()
+    for _ in range(changes):
+        storage = db.get_storage()
+        storage.set_balance(storage.get_balance() - 1) if os.path.exists("balance.txt") else storage.set_balance(0)
+    print(f"balance.txt: {(time.perf_counter() - start) / changes * 1e6:.0f} us/change (no fsync)")
+
+    for window in ("0", "10"):
+        os.environ["LEDGER_FSYNC_WINDOW_MS"] = window
+        book = ledger.Ledger(os.path.join(os.getcwd(), f"ledger-{window}"))
+        book.set(0)
+
+        def worker():
+            for _ in range(changes // threads):
+                book.change(-1, "benchmark")
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        print(f"ledger, {window} ms window, {threads} threads: {(time.perf_counter() - start) / changes * 1e6:.0f} us/change")
+        book.close()
+
+
+def bench_search() -> None:
+    """find over a year of 10k-row months: scanning every month against the inverted index"""
+    import search_index
+
+    for month in db.months_between("2021.01", "2021.12"):
+        fill_month(month, 10_000)
+    storage = db.get_storage()
+
+    start = time.perf_counter()
+    found = 0
+    for month in storage.months():
+        for date, money, category, description in storage.month_rows(month):
+            found += "описание 123" in description.lower()
+    print(f"scan: {(time.perf_counter() - start) * 1e3:.1f} ms, {found} found")
+
+    # Other benchmarks could have loaded the index before these months were filled
+    search_index.evict(os.getcwd())
+    shutil.rmtree(os.path.join(os.getcwd(), "search"), ignore_errors=True)
+    start = time.perf_counter()
+    index = search_index.get_index()
+    print(f"index build: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    start = time.perf_counter()
+    search_index.SearchIndex(index.root)
+    print(f"index load from snapshot: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        found = index.search(["описание", "123"])
+    print(f"index query: {(time.perf_counter() - start) * 10:.2f} ms, {len(found)} found")
+
+
+def bench_fuzzy() -> None:
+    """Resolving misspelled aliases with the trigram index against an edit distance scan of all aliases"""
+    import random
+    import category_index
+
+    random.seed(1)
+    letters = "абвгдеёжзийклмнопрстуфхцчшщыэюяabcdefghijklmnopqrstuvwxyz"
+    print(f"{'aliases':>8} {'scan, us':>9} {'index, us':>10}")
+    for aliases in (100, 1_000, 5_000):
+        categories = {f"Категория {i}": ["".join(random.choices(letters, k=random.randint(4, 10))) for _ in range(aliases // 100)]
+                      for i in range(100)}
+        db.get_storage().save_categories(categories)
+        category_index.invalidate()
+        index = category_index.get_index()
+
+        # One letter of a random alias replaced
+        words = []
+        for alias in random.sample(index.aliases, min(200, len(index.aliases))):
+            position = random.randrange(len(alias))
+            words.append(alias[:position] + random.choice(letters) + alias[position + 1:])
+
+        start = time.perf_counter()
+        for word in words:
+            limit = category_index.max_distance(word)
+            min((category_index.edit_distance(word, alias, limit), alias) for alias in index.aliases)
+        scan = (time.perf_counter() - start) / len(words) * 1e6
+
+        start = time.perf_counter()
+        for word in words:
+            category_index.resolve_fuzzy(word)
+        lookup = (time.perf_counter() - start) / len(words) * 1e6
+        print(f"{aliases:>8} {scan:>9.0f} {lookup:>10.0f}")
+
+
+def bench_batch() -> None:
+    """Adding a 50-line message expense by expense against adding it as one batch"""
+    import expenses
+    from balance import set_balance
+
+    set_balance(1_000_000)
+    lines = [f"{i + 1} {['taxi', 'cafe', 'food'][i % 3]} batch {i}" for i in range(50)]
+    rounds = 10
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            expenses.save_expense(expenses.parse_expense(line))
+    print(f"one by one: {(time.perf_counter() - start) / rounds * 1e3:.1f} ms/message")
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        expenses.save_batch(lines)
+    print(f"batch:      {(time.perf_counter() - start) / rounds * 1e3:.1f} ms/message")
+
+
+def bench_startup() -> None:
+    """Time to first poll (importing main and creating the application) with the slowest imports by -X importtime"""
+    code = "import time; start = time.perf_counter(); import main; main.create_application(); print(time.perf_counter() - start)"
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.path.dirname(os.path.abspath(__file__)),
+        "TELEGRAM_BOT_TOKEN": "123:benchmark",
+        "TELEGRAM_USER_ID": "1"
+    }
+
+    timings = []
+    for _ in range(5):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout) * 1e3)
+    print(f"time to first poll: median {statistics.median(timings):.0f} ms, min {min(timings):.0f} ms")
+
+    # "import time: self [us] | cumulative | imported package" lines of the last run
+    imports = []
+    for line in result.stderr.splitlines()[1:]:
+        self_time, cumulative, package = line.removeprefix("import time:").split("|")
+        imports.append((int(cumulative), package.strip()))
+    for cumulative, package in sorted(imports, reverse=True)[:10]:
+        print(f"{cumulative / 1e3:>8.1f} ms  {package}")
+
+
+BENCHMARKS = {
+    "append": bench_append,
+    "month_stat": bench_month_stat,
+    "range_stat": bench_range_stat,
+    "month_cache": bench_month_cache,
+    "balance": bench_balance,
+    "search": bench_search,
+    "fuzzy": bench_fuzzy,
+    "batch": bench_batch,
+    "startup": bench_startup,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        for name in names:
+            print(f"== {name}: {BENCHMARKS[name].__doc__}")
+            BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Bounded thread pool for blocking work of handlers.
+
+Handlers are coroutines sharing one event loop, so file I/O, storage and transaction locks
+and waiting for the ledger fsync are pushed to these threads instead of stalling every
+other update. pandas and matplotlib work goes to the render process pool instead.
+The function runs in the context of the caller, so it sees the data directory of its user.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def pool() -> ThreadPoolExecutor:
+    """Get the pool of IO_WORKERS threads (8 by default), starting it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=int(os.getenv("IO_WORKERS", "8")), thread_name_prefix="blocking")
+        return _pool
+
+
+async def run(func: Callable, *args, **kwargs) -> Any:
+    """Call the function in the pool and wait for its result without blocking the event loop"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(pool(), functools.partial(context.run, func, *args, **kwargs))
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
-import json
-import os
-from telegram.update import Update
+from telegram import Update
 
 from deleting import InvalidDeleteQuery
+from storage import get_storage
+import blocking
+import category_index
+from transaction import transaction
 
 
 def parse_message(message: str) -> tuple[str, list[str]]:
@@ -38,26 +40,19 @@ def parse_message(message: str) -> tuple[str, list[str]]:
 
 
 def add_category(name, aliases) -> None:
-    """Add new category to categories.json (create if doesn't exist)."""
+    """Add new category to categories (create them if they don't exist)."""
 
-    path_to_categories_file = os.path.join(os.getcwd(), "categories.json")
+    with transaction("categories"):
+        # Add "Other" if first time creating categories
+        try:
+            categories = get_storage().load_categories()
+        except FileNotFoundError:
+            categories = {"Другое": ["другое"]}
 
-    # Add "Other" if first time creating file
-    if not os.path.exists(path_to_categories_file):
-        with open("categories.json", "a", encoding="utf8") as f:
-            categories = json.dumps({"Другое": ["другое"], name: aliases}, indent=4, ensure_ascii=False)
-            f.write(categories)
-            return
-
-    # Actual addition
-    with open("categories.json", "r+", encoding="utf8") as f:
-        categories = json.load(f)
+        # Actual addition
         categories[name] = aliases
-        new_categories = json.dumps(categories, indent=4, ensure_ascii=False)
-        f.truncate()
-        f.seek(0)
-        f.write(new_categories)
-        return
+        get_storage().save_categories(categories)
+        category_index.invalidate()
     
 
 def delete_category(name: str) -> None:
@@ -66,56 +61,51 @@ def delete_category(name: str) -> None:
     # Turn name into normal form
     name = name.lower().capitalize()
     
-    # Can raise KeyError and FileNotFoundError
-    with open("categories.json", "r+", encoding="utf8") as f:
-        categories = json.load(f)
+    with transaction("categories"):
+        # Can raise KeyError and FileNotFoundError
+        categories = get_storage().load_categories()
         del categories[name]
-        new_categories = json.dumps(categories, indent=4, ensure_ascii=False)
-
-        f.truncate(0)
-        f.seek(0)
-        f.write(new_categories)
-        return
+        get_storage().save_categories(categories)
+        category_index.invalidate()
 
 
-def handle_addition(update: Update) -> None:
+async def handle_addition(update: Update) -> None:
     """Check message validity, then add category and aliases to categories.json"""
     try:
         name, aliases = parse_message(update.message.text)
-        add_category(name, aliases)
+        await blocking.run(add_category, name, aliases)
 
         reply = f"Добавлена новая категория \"{name}\"\nСинонимы: "
         reply += ", ".join(aliases)
 
-        update.message.reply_text(reply)
+        await update.message.reply_text(reply)
     
     except InvalidDeleteQuery:
-        update.message.reply_text("❌ Неправильный формат записи категории. Должно быть:\n{Имя}:{синоним}, {синоним}, ...")
+        await update.message.reply_text("❌ Неправильный формат записи категории. Должно быть:\n{Имя}:{синоним}, {синоним}, ...")
     
-def handle_deletion(update: Update) -> None:
+async def handle_deletion(update: Update) -> None:
     """Delete category by name in message"""
     try:
         name = update.message.text.partition(" ")[2]
-        delete_category(name)
+        await blocking.run(delete_category, name)
 
-        update.message.reply_text(f"Удалена категория: {name.lower().capitalize()}")
+        await update.message.reply_text(f"Удалена категория: {name.lower().capitalize()}")
     except KeyError:
-        update.message.reply_text("❌ Указанная категория не существует.")
+        await update.message.reply_text("❌ Указанная категория не существует.")
     except FileNotFoundError:
-        update.message.reply_text("❌ Категории еще не добавлены. Файла на существует.")
+        await update.message.reply_text("❌ Категории еще не добавлены. Файла на существует.")
 
-def show_categories(update: Update) -> None:
+async def show_categories(update: Update) -> None:
     """Reply with all available categories or warn that file doesn't exist."""
     try:
-        with open("categories.json", "r", encoding="utf8") as f:
-            categories = json.load(f)
+        categories = await blocking.run(category_index.get_categories)
         
         reply = "Категории:\n"
-        for name, aliases in categories:
+        for name, aliases in categories.items():
             reply += f"{name}: "
             reply += ", ".join(aliases)
             reply += "\n"
         
-        update.message.reply_text(reply)
+        await update.message.reply_text(reply)
     except FileNotFoundError:
-        update.message.reply_text("❌ Категории еще не добавлены. Файла на существует.")
\ No newline at end of file
+        await update.message.reply_text("❌ Категории еще не добавлены. Файла на существует.")
\ No newline at end of file
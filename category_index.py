@@ -0,0 +1,142 @@
+"""
+Process-wide cache of categories and their aliases.
+
+Categories are loaded once per data directory and kept together with an alias -> name
+dictionary, so resolving a category is a single lookup. The cache is reloaded when the
+storage reports another version of categories (e.g. categories.json was edited by hand)
+or after it's invalidated by adding or deleting a category.
+
+Misspelled aliases are resolved through a trigram index: only aliases sharing enough
+trigrams with the word (and close enough in length) are compared by edit distance.
+"""
+import threading
+from collections import Counter
+from typing import NamedTuple
+
+from storage import data_root, get_storage
+
+
+class CategoryIndex(NamedTuple):
+    version: tuple
+    # Name -> aliases, in the order categories were added
+    categories: dict[str, list[str]]
+    # Alias -> name, the first added category wins if an alias is used twice
+    by_alias: dict[str, str]
+    # All aliases and trigram -> positions of aliases containing it
+    aliases: list[str]
+    trigrams: dict[str, list[int]]
+
+
+_indexes: dict[str, CategoryIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def trigrams_of(word: str) -> list[str]:
+    """Trigrams of the word padded with two "#" on both sides, so a word of n letters has n + 2 of them"""
+    padded = f"##{word}##"
+    return [padded[i:i+3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(first: str, second: str, limit: int) -> int:
+    """Levenshtein distance of two words, or limit + 1 as soon as it's known to exceed the limit"""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (first_char != second_char)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def max_distance(word: str) -> int:
+    """Typos tolerated in a word: none in short words, one up to 7 letters and two in longer ones"""
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+def build(version: tuple, categories: dict[str, list[str]]) -> CategoryIndex:
+    by_alias = {}
+    for name, aliases in categories.items():
+        for alias in aliases:
+            by_alias.setdefault(alias, name)
+
+    aliases = list(by_alias)
+    trigrams = {}
+    for position, alias in enumerate(aliases):
+        for trigram in set(trigrams_of(alias)):
+            trigrams.setdefault(trigram, []).append(position)
+    return CategoryIndex(version, categories, by_alias, aliases, trigrams)
+
+
+def get_index() -> CategoryIndex:
+    """Get categories of the current data directory or throw FileNotFoundError if they don't exist"""
+    root = data_root()
+    storage = get_storage()
+    version = storage.categories_version()
+
+    index = _indexes.get(root)
+    if index is not None and index.version == version:
+        return index
+
+    with _indexes_lock:
+        # Version is read before loading, so a concurrent save can only make the next call reload again
+        index = _indexes[root] = build(version, storage.load_categories())
+        return index
+
+
+def invalidate() -> None:
+    """Forget cached categories of the current data directory"""
+    with _indexes_lock:
+        _indexes.pop(data_root(), None)
+
+
+def get_categories() -> dict[str, list[str]]:
+    """All categories with their aliases or throw FileNotFoundError, the result must not be modified"""
+    return get_index().categories
+
+
+def resolve(alias: str) -> str | None:
+    """Name of the category with the alias or None, throw FileNotFoundError if categories don't exist"""
+    return get_index().by_alias.get(alias.lower())
+
+
+def resolve_fuzzy(word: str) -> str | None:
+    """
+    Name of the category with the closest alias within max_distance of the word or None,
+    ties are won by the category added first. Throw FileNotFoundError if categories don't exist
+    """
+    index = get_index()
+    word = word.lower()
+    if (name := index.by_alias.get(word)) is not None:
+        return name
+    if (limit := max_distance(word)) == 0:
+        return None
+
+    # A single edit changes at most 3 trigrams, so a match shares at least this many with the word
+    word_trigrams = set(trigrams_of(word))
+    required = len(word_trigrams) - 3 * limit
+    shared = Counter()
+    for trigram in word_trigrams:
+        shared.update(index.trigrams.get(trigram, ()))
+
+    best, best_distance = None, limit + 1
+    for position in sorted(position for position, count in shared.items() if count >= required):
+        distance = edit_distance(word, index.aliases[position], min(limit, best_distance - 1))
+        if distance < best_distance:
+            best, best_distance = position, distance
+
+    return None if best is None else index.by_alias[index.aliases[best]]
+
+
+def evict(root: str) -> None:
+    """Forget cached categories of the data directory"""
+    with _indexes_lock:
+        _indexes.pop(root, None)
@@ -0,0 +1,132 @@
+"""
+Rendering of statistic charts into PNG bytes.
+
+Every chart is drawn on its own Figure with the Agg canvas instead of the global pyplot
+state, so concurrent queries can't clobber each other and no files are written.
+Rendered images are cached by a hash of the data they are drawn from.
+"""
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+CACHE_SIZE = 32
+
+_cache: OrderedDict[str, bytes] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def title_of(period: str) -> str:
+    """English name of the month + year in number form, "YYYY.MM-YYYY.MM" becomes a range of them"""
+    titles = []
+    for month in period.split("-"):
+        full_date = [int(x) for x in f"{month}.01".split(".")]
+        titles.append(datetime.datetime(*full_date).strftime("%B %Y"))
+    return " - ".join(titles)
+
+
+def cached(kind: str, data: dict, render) -> bytes:
+    """Get rendered chart from the cache or render it and remember the result"""
+    key = hashlib.sha256(json.dumps([kind, data], sort_keys=True, ensure_ascii=False).encode("utf8")).hexdigest()
+    with _cache_lock:
+        if (png := _cache.get(key)) is not None:
+            _cache.move_to_end(key)
+            return png
+
+    png = render()
+
+    with _cache_lock:
+        _cache[key] = png
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return png
+
+
+def to_png(figure: Figure) -> bytes:
+    """Save figure into PNG bytes and release it"""
+    buffer = BytesIO()
+    FigureCanvasAgg(figure).print_png(buffer)
+    figure.clear()
+    return buffer.getvalue()
+
+
+def bar_chart(month_statistic: dict) -> bytes:
+    """Barchart of spendings in each category based on month statistic"""
+    data: dict = month_statistic["each_category_total"]
+    period: str = month_statistic["month"]
+    currency: str = month_statistic.get("currency", "грн")
+
+    def render() -> bytes:
+        categories = list(data.keys())
+        values = list(data.values())
+
+        # Creating the diagram and signing both axis with labels
+        figure = Figure(figsize=(10, 6))
+        ax = figure.add_subplot()
+        ax.set_xticks(range(len(data)), categories)
+        ax.set_xlabel("Категории расходов", labelpad=10)
+        ax.set_ylabel(f"Общая сумма, {currency}")
+
+        # Title will be the english name of the month + year in number form
+        ax.set_title(title_of(period))
+
+        # Creating bars on the diagram, height is based on the total spending in each category
+        bar_chart = ax.bar(range(len(data)), values, width=0.5)
+        for index, rect in enumerate(bar_chart):
+            height = rect.get_height()
+            ax.text(rect.get_x() + rect.get_width() / 2, height + 8, values[index], ha="center")
+
+        return to_png(figure)
+
+    return cached("bar", {"period": period, "currency": currency, "data": data}, render)
+
+
+def trend_chart(range_statistic: dict) -> bytes:
+    """Line chart of spendings in each month based on statistic of several months"""
+    data: dict = range_statistic["trend"]
+    period: str = range_statistic["month"]
+
+    def render() -> bytes:
+        months = list(data.keys())
+        values = list(data.values())
+
+        figure = Figure(figsize=(10, 6), layout="tight")
+        ax = figure.add_subplot()
+        ax.set_xticks(range(len(months)), months, rotation=45)
+        ax.set_xlabel("Месяцы", labelpad=10)
+        ax.set_ylabel("Общая сумма, грн")
+        ax.set_title(title_of(period))
+
+        ax.plot(range(len(months)), values, marker="o")
+        for index, value in enumerate(values):
+            ax.text(index, value, value, ha="center", va="bottom")
+
+        return to_png(figure)
+
+    return cached("trend", {"period": period, "data": data}, render)
+
+
+def balance_chart(month: str, daily: dict[str, int]) -> bytes:
+    """Line chart of the balance at the end of every day of the month"""
+
+    def render() -> bytes:
+        days = [day.split(".")[2] for day in daily]
+        values = list(daily.values())
+
+        figure = Figure(figsize=(10, 6), layout="tight")
+        ax = figure.add_subplot()
+        ax.set_xticks(range(len(days)), days)
+        ax.set_xlabel("Дни", labelpad=10)
+        ax.set_ylabel("Баланс, грн")
+        ax.set_title(title_of(month))
+
+        ax.step(range(len(days)), values, where="post", marker="o")
+        return to_png(figure)
+
+    return cached("balance", {"period": month, "data": daily}, render)
@@ -1,21 +1,110 @@
+import asyncio
 import os
+import sys
 
+from telegram.ext import Application
 
-def terminal_loop():
+import blocking
+import db
+import http_client
+import ledger
+import rate_history
+import rollups
+import search_index
+import users
+
+
+async def read_commands() -> asyncio.StreamReader | None:
+    """Reader of stdin lines on the event loop, None if stdin can't be read asynchronously (e.g. it's a file)"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except (ValueError, OSError):
+        return None
+    return reader
+
+
+def roots_of(user_ids: list[str]) -> list[str]:
+    """Data directories of the given users, of the owner and every other user if none are given"""
+    if not user_ids:
+        return users.known_roots()
+    return [users.root_of(int(user_id)) for user_id in user_ids]
+
+
+def rebuild(root: str) -> str:
+    """Recompute month rollups and search index of the data directory from its expenses"""
+    with users.session(root):
+        months = rollups.rebuild_all()
+        search_index.get_index().rebuild()
+    return f"{root}: rebuilt rollups of {len(months)} months and search index"
+
+
+def verify_ledger(root: str) -> str:
+    """Check that the balance of the data directory adds up from the whole history of changes"""
+    with users.session(root):
+        try:
+            return f"{root}: ledger is consistent, balance: {ledger.get_ledger().verify()}"
+        except ledger.LedgerCorrupted as e:
+            return f"{root}: ledger is corrupted: {e}"
+
+
+async def terminal_loop(application: Application) -> None:
     """
     A loop function for recieving terminal commands,
-    is a target of a Thread created by controller's main function.
+    is a task of the application started by main.
+    Commands touching files run in the blocking pool, so updates keep being handled meanwhile.
     """
+    if (reader := await read_commands()) is None:
+        return
+
     while True:
-        command = input("$ ")
+        print("$ ", end="", flush=True)
+        line = await reader.readline()
+        # stdin is closed, e.g. the bot runs as a service
+        if not line:
+            return
+        command = line.decode().strip()
+        if not command:
+            continue
         match command:
             case "q" | "quit" | "exit":
                 print("Bot terminated. Process ended with exit code 0")
 
-                """
-                Kill the entire process. (sys.exit(0) would only kill this thread,
-                which is not main)
-                """
-                os._exit(0)
+                # Polling stops and run_polling returns in the main function
+                application.stop_running()
+                return
+            case _ if command.split()[0] in ["rebuild", "ledger"]:
+                # "rebuild [user id ...]": recompute rollups and search index, e.g. after editing files by hand,
+                # "ledger [user id ...]": verify the balance, both for every user if no ids are given
+                name, *user_ids = command.split()
+                try:
+                    roots = roots_of(user_ids)
+                except ValueError:
+                    print("User id must be a number")
+                    continue
+                for root in roots:
+                    if not os.path.isdir(root):
+                        print(f"{root}: no data")
+                        continue
+                    print(await blocking.run(rebuild if name == "rebuild" else verify_ledger, root))
+            case _ if command.startswith("backfill"):
+                # Bulk download of past exchange rates: "backfill YYYY.MM" or "backfill YYYY.MM YYYY.MM"
+                months = command.split()[1:]
+                try:
+                    added = 0
+                    for month in db.months_between(months[0], months[-1]):
+                        added += await rate_history.backfill_month(month)
+                    print(f"Backfilled rates of {added} days")
+                except Exception as e:
+                    print(f"Backfill failed: {e!r}")
+            case "users":
+                # Data directories kept open, least recently used first
+                for root, sessions, size in users.stats():
+                    print(f"{root}: {sessions} updates in progress, ~{size / 2 ** 20:.1f} MB cached")
+            case "http":
+                # Latency and error counters of the exchange rates API
+                for name, value in http_client.get_client().stats().items():
+                    print(f"{name}: {value}")
             case _:
                 print("Unknown command!")
\ No newline at end of file
@@ -1,4 +1,4 @@
-from telegram.update import Update
+from telegram import Update
 import os
 
 # My modules
@@ -9,25 +9,29 @@ import exchange
 import month
 import deleting
 import categories
+import search
 import utils
 
 
 @utils.authorize
-def start(update: Update, context):
-    update.message.reply_text("""
+async def start(update: Update, context):
+    await update.message.reply_text("""
     Бот для учета расходов и доходов.
     """)
 
 @utils.authorize
-def help(update: Update, context):
-    update.message.reply_text("""
+async def help(update: Update, context):
+    await update.message.reply_text("""
     Список команд:
 /start  -> Начало работы.
 /help   -> Это сообщение.
 bl  -> Посмотреть баланс.
 bl {число}  -> Установить новый баланс.
 bl {валюта}  -> Перевести баланс в другую валюту.
+bl YYYY.MM.DD  -> Баланс на конец дня.
+bl history YYYY.MM  -> График баланса за месяц.
 {число} {категория} {описание}  -> Добавить расход. Описание опционально.
+Несколько расходов, каждый с новой строки  -> Добавить их все сразу.
 del {номер}  -> Удалить расход по номеру в списке месяца. -1 или \"last\" удаляет последний.
 categories  -> Посмотреть список категорий.
 add {название}: {синоним}, {синоним}, ...  ->  Добавить категорию.
@@ -35,68 +39,86 @@ del {категория}  -> Удалить категорию.
 + {число} {источник}  -> Добавить доход.
 month   -> Список всех расходов за текущий месяц.
 month YYYY.MM  ->  Статистика расходов за месяц YYYY.MM
+month YYYY.MM-YYYY.MM  ->  Статистика расходов за несколько месяцев
+month YYYY.MM {валюта}  ->  Статистика за месяц в валюте по курсу дня каждого расхода
+year YYYY  ->  Статистика расходов за год
 cv {из} {в}  -> Курс первой валюты ко второй.
 cv {число} {из} {в}  -> Перевод суммы из одной валюты в другую.
+find {слова} [>{от}] [<{до}] [YYYY.MM-YYYY.MM]  -> Поиск расходов по категории и описанию.
     """)
 
 @utils.authorize
-def expense(update: Update, context):
-    expenses.handle_expense(update)
+async def expense(update: Update, context):
+    await expenses.handle_expense(update)
 
 @utils.authorize
-def income(update: Update, context):
-    incomes.handle_income(update)
+async def income(update: Update, context):
+    await incomes.handle_income(update)
 
 @utils.authorize
-def balance_query(update: Update, context):
-    balance.handle_balance_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
+async def balance_query(update: Update, context):
+    await balance.handle_balance_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
 
 @utils.authorize
-def convert(update: Update, context):
-    exchange.handle_exchange_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
+async def convert(update: Update, context):
+    await exchange.handle_exchange_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
 
 @utils.authorize
-def month_query(update: Update, context):
-    month.handle_month_query(update)
+async def month_query(update: Update, context):
+    await month.handle_month_query(update)
 
 @utils.authorize
-def delete_expense(update: Update, context):
-    deleting.handle_expense_deleting(update)
+async def month_page(update: Update, context):
+    await month.handle_month_page(update)
 
 @utils.authorize
-def show_categories(update: Update, context):
-    categories.show_categories(update)
+async def fuzzy_category(update: Update, context):
+    await expenses.handle_category_choice(update)
 
 @utils.authorize
-def add_category(update: Update, context):
-    categories.handle_addition(update)
+async def delete_expense(update: Update, context):
+    await deleting.handle_expense_deletion(update)
 
 @utils.authorize
-def delete_category(update: Update, context):
-    categories.handle_deletion(update)
+async def find(update: Update, context):
+    await search.handle_search(update)
+
+@utils.authorize
+async def show_categories(update: Update, context):
+    await categories.show_categories(update)
+
+@utils.authorize
+async def add_category(update: Update, context):
+    await categories.handle_addition(update)
+
+@utils.authorize
+async def delete_category(update: Update, context):
+    await categories.handle_deletion(update)
 
 # Handle message based on its type (first word determines the type)
 @utils.authorize
-def handle_message(update: Update, context):
+async def handle_message(update: Update, context):
     message_type = utils.get_type_of_message(update.message.text)
     match message_type:
         case "expense":
-            expenses.handle_expense(update)
+            await expenses.handle_expense(update)
         case "income":
-            incomes.handle_income(update)
+            await incomes.handle_income(update)
         case "balance":
-            balance.handle_balance_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
+            await balance.handle_balance_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
         case "exchange_query":
-            exchange.handle_exchange_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
+            await exchange.handle_exchange_query(update, API_KEY=os.getenv("EXCHANGE_RATE_API_KEY"))
         case "month":
-            month.handle_month_query(update)
-        case "delete":
-            deleting.handle_expense_deletion(update)
+            await month.handle_month_query(update)
+        case "delete_expense":
+            await deleting.handle_expense_deletion(update)
         case "categories":
-            categories.show_categories(update)
+            await categories.show_categories(update)
         case "add_category":
-            categories.handle_addition(update)
+            await categories.handle_addition(update)
         case "delete_category":
-            categories.handle_deletion(update)
+            await categories.handle_deletion(update)
+        case "find":
+            await search.handle_search(update)
         case _:
-            update.message.reply_text("Неизвестная команда😐")
\ No newline at end of file
+            await update.message.reply_text("Неизвестная команда😐")
\ No newline at end of file
@@ -1,210 +1,219 @@
+import contextvars
 import datetime
-import os.path
-from os import getcwd
-import json
-import pandas as pd
-import matplotlib.pyplot as plt
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 
+from storage import MonthParseError, fixed_month, get_storage
+import category_index
+import rollups
+import search_index
+from transaction import transaction
 
-class MonthParseError(Exception):
-    """Custom exception to be thrown if requsted {month}.csv file doesn't exist"""
-    pass
 
+def current_month() -> str:
+    """YYYY.MM of today"""
+    return fixed_month(datetime.date.today())
 
-def fixed_month(date: datetime.date) -> str:
-    """Replace the "-" by "." in date and cut the day to leave only YYYY.MM"""
 
-    return ".".join(str(date).split("-")[:2])
+def discard_derived(month: str) -> None:
+    """Rebuild rollup and search index from the expenses after a failed change"""
+    rollups.discard(month)
+    search_index.get_index().rebuild()
 
 
-def path_of_month(month: str) -> str:
-    """Getting absolute path to the {month}.csv file"""
+def add_expense(expense) -> None:
+    """Add expense to the current month, either with its rollup and search index or not at all"""
+    add_expenses([expense])
 
-    cwd = getcwd()
-    expenses_dir_path = os.path.join(cwd, "expenses")
-    month_file_path = os.path.join(expenses_dir_path, month + ".csv")
-    return month_file_path
 
+def add_expenses(expenses: list) -> None:
+    """Add expenses to the current month with a single write, either all with their rollup and search index or none"""
+    month = current_month()
 
-def add_expense(expense) -> None:
-    """Add expense to a csv file of the current month"""
-    month = fixed_month(datetime.date.today())
-    month_file_path = path_of_month(month)
-
-    # Creating {month}.csv file if it doesn't exist yet and add the headers
-    if not os.path.exists(month_file_path):
-        with open(month_file_path, "a", encoding="utf8") as f:
-            f.write("Номер|Дата|Сумма|Категория|Описание\n")
-
-    # Calculating index for expense
-    new_index = ""
-    with open(month_file_path, "r", encoding="utf8") as f:
-        if (last_number := f.readlines()[-1].split("|")[0]) == "Номер":
-            new_index = "1"
-        elif last_number.isdigit():
-            new_index = int(last_number) + 1
-    
-    # Full list of parameters for writing into file
-    full_list = [str(x) for x in (new_index, *expense._asdict().values())]
-    
-    # Appending the expense in following format: "...|...|...|...|..."
-    with open(month_file_path, "a", encoding="utf8") as f:
-        new_line = "|".join(full_list) + "\n"
-        f.write(new_line)
+    def remove_added() -> None:
+        for _ in expenses:
+            get_storage().delete_expense(month, -1)
+
+    # Loading the search index can take a while, it's done before the month is locked.
+    # Expenses are only written after the index is loaded, so its rebuild can't count them twice
+    index = search_index.get_index()
+    with transaction(f"month:{month}") as tx:
+        # Loading the rollup before the write for the same reason
+        rollups.ensure_rollup(month)
+
+        # Undone in reverse order: the expenses are removed first, then derived data is rebuilt without them
+        tx.on_rollback(lambda: discard_derived(month))
+        get_storage().add_expenses(month, expenses)
+        tx.on_rollback(remove_added)
+
+        rollups.add_expenses(month, expenses)
+        index.add_expenses(month, expenses)
 
 
 def delete_expense(index: int):
     """Delete expense from database by its index in the current month"""
+    month = current_month()
 
-    # Getting path to file of the current month
-    month = fixed_month(datetime.date.today())
-    month_file_path = path_of_month(month)
+    search = search_index.get_index()
+    with transaction(f"month:{month}") as tx:
+        rollups.get_rollup(month)
 
-    # Creating DataFrame
-    try:
-        df = pd.read_csv(month_file_path, sep="|")
-    except FileNotFoundError:
-        raise MonthParseError
-
-    if index > df.tail(1).index + 1:
-        raise ValueError
-
-    if index > 0:
-        # Getting the expense to be deleted for returning from the function
-        row = df.iloc[index-1]
-        deleted_expense = {
-            "date": row["Дата"],
-            "money": int(row["Сумма"]),
-            "category": row["Категория"],
-            "description": row["Описание"]
-        }
+        tx.on_rollback(lambda: discard_derived(month))
+        deleted_expense = get_storage().delete_expense(month, index)
+        tx.on_rollback(lambda: restore_expense(month, index, deleted_expense))
 
-        # Deleting the expense
-        df.drop(index=index-1, axis=0, inplace=True)
-
-        # Resetting new index for every left expense
-        df.reset_index(drop=True, inplace=True)
-        for i in range(len(list((df.iterrows())))):
-            df.loc[i, ["Номер"]] = i + 1
-    
-    if index == -1:
-        # Getting the expense to be deleted for returning from the function
-        row = df.iloc[index]
-        deleted_expense = {
-            "date": row["Дата"],
-            "money": int(row["Сумма"]),
-            "category": row["Категория"],
-            "description": row["Описание"]
-        }
-    
-        # Deleting the expense
-        df.drop(df.tail(1).index, axis=0, inplace=True)
+        rollups.delete_expense(month, deleted_expense)
+        search.delete_expense(month, deleted_expense)
+        return deleted_expense
 
-    # Saving file
-    df.to_csv(month_file_path, sep="|", index=False)
 
-    return deleted_expense
+def restore_expense(month: str, index: int, expense: dict) -> None:
+    """
+    Put the deleted expense back at its index in the month (-1 for the last one),
+    so the indexes of other expenses shown to the user stay as they were
+    """
+    try:
+        rows = get_storage().month_rows(month)
+    except MonthParseError:
+        rows = []
+    position = len(rows) if index == -1 else index - 1
+    rows.insert(position, [expense["date"], str(expense["money"]), expense["category"], expense["description"]])
+    get_storage().replace_month(month, rows)
+
+
+def undo_delete_expense(month: str, index: int, expense: dict) -> None:
+    """Bring the deleted expense back at its index together with its rollup and search index entries"""
+    with transaction(f"month:{month}") as tx:
+        tx.on_rollback(lambda: discard_derived(month))
+        restore_expense(month, index, expense)
+        rollups.add_expense(month, SimpleNamespace(**expense))
+        search_index.get_index().add_expense(month, SimpleNamespace(**expense))
 
 
 def current_month_expenses() -> list[list[str]]:
     """Get all current month expenses as a list"""
-    expenses = []
-
-    # Constructing path to the file
     month = fixed_month(datetime.date.today())
-    month_file_path = path_of_month(month)
+    return get_storage().month_rows(month)
+
+
+def month_page(month: str, start: int, count: int) -> tuple[list[list[str]], int]:
+    """Get count expenses of the month from start and the total number of its expenses"""
+    return get_storage().month_page(month, start, count)
+
+
+def export_month(month: str) -> str:
+    """Get path to a csv file with all expenses of the month"""
+    return get_storage().export_month(month)
+
+
+def months_between(first: str, last: str) -> list[str]:
+    """All months from first to last YYYY.MM inclusive"""
+    year, month = [int(x) for x in first.split(".")]
+    last_year, last_month = [int(x) for x in last.split(".")]
+    months = []
+    while (year, month) <= (last_year, last_month):
+        months.append(f"{year}.{month:02}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def statistic(period: str, month_rollups: dict[str, dict]) -> dict:
+    """Merge rollups of one or several months into statistic in dictionary form"""
+
+    # Single biggest expenses (there may be less than five of them),
+    # earlier months and earlier expenses win ties
+    biggest = heapq.nlargest(5, (
+        (money, -month_number, seq, date, category, description)
+        for month_number, rollup in enumerate(month_rollups.values())
+        for money, seq, date, category, description in rollup["biggest"]
+    ))
+    biggest_expenses = [
+        {
+            "date": date,
+            "money": money,
+            "category": category,
+            "description": description
+        }
+        for money, month_number, seq, date, category, description in biggest
+    ]
 
-    # Opening the file if it exists or throwing FileNotFoundError
-    try:
-        with open(month_file_path, "r", encoding="utf8") as file:
-            # Skip headers (first line)
-            next(file)
-            for line in file:
-                expense_attributes_list = line.split("|")[1:]
-                expenses.append(expense_attributes_list)
-    except FileNotFoundError:
-        raise MonthParseError
+    # Total money spent in each category, categories without expenses are left with 0
+    # (raise FileNotFoundError if categories don't exist)
+    categories = category_index.get_categories().keys()
+    each_category_total = {cat: 0 for cat in categories}
+    for rollup in month_rollups.values():
+        for cat, totals in rollup["categories"].items():
+            each_category_total[cat] = each_category_total.get(cat, 0) + totals["sum"]
+
+    return {
+        "month": period,
+        "total": sum(rollup["total"] for rollup in month_rollups.values()),
+        "quantity": sum(rollup["quantity"] for rollup in month_rollups.values()),
+        "biggest_expenses": biggest_expenses,
+        "each_category_total": each_category_total,
+        # Total money spent in each month of the period
+        "trend": {month: rollup["total"] for month, rollup in month_rollups.items()}
+    }
 
-    return expenses
 
 def month_stat(month: str):
     """Get requsted month statistic in dictionary form."""
-    # Creating DataFrame from {month}.csv file
-    month_file_path = path_of_month(month)
-    try:
-        df = pd.read_csv(month_file_path, sep="|")
-    except:
-        raise MonthParseError("Файла не существует")
-    
-    # Total number of expenses
-    quantity = int(df.tail(1)["Номер"])
-
-    # Total money spent in this month:
-    total = 0
-    for index, row in df.iterrows():
-        total += row["Сумма"]
-
-
-    # Single biggest expenses:
-
-    sorted_df = df.sort_values("Сумма", ascending=False, inplace=False)
-    # Turning empty descriptions (NaN) into empty strings ""
-    sorted_notnull_df = sorted_df.where(pd.notnull(sorted_df), "")
-    biggest_expenses = []
-    for i in range(5):
-        expense_df = sorted_notnull_df.iloc[i]
-        expense = {
-            "date": expense_df["Дата"],
-            "money": expense_df["Сумма"],
-            "category": expense_df["Категория"],
-            "description": expense_df["Описание"]
-        }
-        biggest_expenses.append(expense)
+    # Everything is taken from the rollup of the month, expenses themselves aren't read
+    return statistic(month, {month: rollups.get_rollup(month)})
 
 
-    # Total money spent in each category:
+def converted_month_stat(month: str, currency: str) -> dict:
+    """Month statistic with every expense converted at the rate of its day"""
+    import rate_history
 
-    # Getting all category names (raise FileNotFoundError if file doesn't exist)
-    with open("categories.json", "r", encoding="utf8") as f:
-        categories = json.load(f)
-        categories = categories.keys()
-    # Creating dictionary with all 0 values as counters for each category
-    each_category_total = {cat: 0 for cat in categories}
-    for index, row in df.iterrows():
-        money = row["Сумма"]
-        category = row["Категория"]
-        each_category_total[category] += money
+    df = rate_history.convert_frame(get_storage().month_frame(month), currency)
+    converted = f"Сумма, {currency.upper()}"
+
+    biggest = df.sort_values(converted, ascending=False, kind="stable").head(5)
+    each_category_total = {cat: 0.0 for cat in category_index.get_categories().keys()}
+    for cat, total in df.groupby("Категория", observed=True)[converted].sum().items():
+        each_category_total[cat] = round(float(total), 2)
 
+    total = round(float(df[converted].sum()), 2)
     return {
         "month": month,
+        "currency": currency.upper(),
         "total": total,
-        "quantity": quantity,
-        "biggest_expenses": biggest_expenses,
-        "each_category_total": each_category_total
+        "quantity": len(df),
+        "biggest_expenses": [
+            {
+                "date": row["Дата"],
+                "money": round(float(row[converted]), 2),
+                "category": row["Категория"],
+                "description": row["Описание"]
+            }
+            for row in biggest.to_dict("records")
+        ],
+        "each_category_total": each_category_total,
+        "trend": {month: total}
     }
 
-def generate_bar_chart_img(month_statistic):
-    """Generate Matplotlib barchart based on month statistic and save it to {month}.png"""
-    data: dict = month_statistic["each_category_total"]
-    categories = list(data.keys())
-    values = list(data.values())
-
-    # Creating the diagram and signing both axis with labels
-    plt.figure(figsize=(10,6))
-    plt.xticks(range(len(data)), categories)
-    plt.xlabel("Категории расходов", labelpad=10)
-    plt.ylabel("Общая сумма, грн")
-
-    # Title will be the english name of the month + year in number form
-    full_date = [int(x) for x in f"{month_statistic['month']}.01".split(".")]
-    date_obj = datetime.datetime(*full_date)
-    plt.title(date_obj.strftime("%B %Y"))
-
-    # Creating bars on the diagram, height is based on the total spending in each category
-    bar_chart = plt.bar(range(len(data)), values, width=0.5)
-    for index, rect in enumerate(bar_chart):
-        height = rect.get_height()
-        plt.text(rect.get_x() + rect.get_width() / 2, height + 8, values[index], ha="center")
-
-    # Saving as {month}.png for future reply and following removal
-    plt.savefig(f"{month_statistic['month']}.png")
\ No newline at end of file
+
+def load_rollup(month: str) -> dict | None:
+    try:
+        return rollups.get_rollup(month)
+    except MonthParseError:
+        return None
+
+
+def range_stat(first: str, last: str):
+    """
+    Get statistic of all months from first to last YYYY.MM in dictionary form.
+    Month rollups are loaded (or rebuilt) in parallel and then merged.
+    """
+    months = months_between(first, last)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        # Threads don't inherit the context, every load runs in a copy of it to see the data directory of the user
+        futures = [executor.submit(contextvars.copy_context().run, load_rollup, month) for month in months]
+        loaded = dict(zip(months, (future.result() for future in futures)))
+
+    month_rollups = {month: rollup for month, rollup in loaded.items() if rollup is not None}
+    if not month_rollups:
+        raise MonthParseError("Ни одного файла не существует")
+    return statistic(f"{first}-{last}", month_rollups)
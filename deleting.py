@@ -1,8 +1,10 @@
-from telegram.update import Update
+from telegram import Update
 
 from expenses import Expense
-from db import delete_expense, MonthParseError
-from balance import get_balance, set_balance
+from db import current_month, delete_expense, undo_delete_expense, MonthParseError
+from balance import change_balance, wait_for_balance
+from transaction import transaction
+import blocking
 
 
 class InvalidDeleteQuery(Exception):
@@ -33,7 +35,23 @@ def get_index_of_expense(message: str) -> int:
         raise InvalidDeleteQuery
 
 
-def handle_expense_deletion(update: Update) -> None:
+def delete_expense_by_index(index: int) -> tuple[Expense, int]:
+    """Delete the expense from database and reset the balance accordingly, get it and the new balance"""
+    month = current_month()
+    with transaction("balance", f"month:{month}") as tx:
+        # Getting required Expense from database and deleting it
+        deleted = delete_expense(index)
+        deleted_expense = Expense(*deleted.values())
+        # Expense comes back at its index, so the indexes of the others don't change
+        tx.on_rollback(lambda: undo_delete_expense(month, index, deleted))
+
+        # Calaculating and setting new balance
+        new_balance = change_balance(deleted_expense.money, f"delete {deleted_expense.category} {deleted_expense.description}".rstrip(), wait=False)
+    wait_for_balance()
+    return deleted_expense, new_balance
+
+
+async def handle_expense_deletion(update: Update) -> None:
     """
     Delete requested expense from database by provided index
     and reset the balance accordingly
@@ -41,18 +59,10 @@ def handle_expense_deletion(update: Update) -> None:
 
     try:
         index = get_index_of_expense(update.message.text)
+        deleted_expense, new_balance = await blocking.run(delete_expense_by_index, index)
 
-        # Getting required Expense from database and deleting it
-        deleted_expense = delete_expense(index)
-        deleted_expense = Expense(*deleted_expense.values())
-
-        # Calaculating and setting new balance
-        balance = get_balance()
-        new_balance = balance + deleted_expense.money
-        set_balance(new_balance)
-
-        # Reply
-        update.message.reply_text(f"""Удален расход:
+    # Reply
+        await update.message.reply_text(f"""Удален расход:
 {deleted_expense.category} {deleted_expense.money}
 🎇 Описание: {deleted_expense.description}
 🗓 Дата: {deleted_expense.date}
@@ -61,6 +71,6 @@ def handle_expense_deletion(update: Update) -> None:
     
 
     except (InvalidDeleteQuery, ValueError):
-        update.message.reply_text("❗️ Номер расхода должен быть целым положительным числом, не превышающим общее число расходов. Или же быть равным -1 или слову \"last\", для удаления последнего расхода.")
+        await update.message.reply_text("❗️ Номер расхода должен быть целым положительным числом, не превышающим общее число расходов. Или же быть равным -1 или слову \"last\", для удаления последнего расхода.")
     except MonthParseError:
-        update.message.reply_text("❌ В этом месяце еще не было расходов.\nФайла не существует.")
+        await update.message.reply_text("❌ В этом месяце еще не было расходов.\nФайла не существует.")
@@ -1,6 +1,7 @@
-import requests
 from dataclasses import dataclass
-from telegram.update import Update
+from telegram import Update
+
+import rates
 
 currencies = ["usd", "eur", "uah"]
 
@@ -18,16 +19,22 @@ class InvalidExchangeQueryError(Exception):
 class Exchange_Query():
     """
     Respresents an Exchange Query object.
-    Method convert() retrieves the exchange information from an API.
+    Method convert() derives the exchange information from the cached table of rates.
     """
     from_currency: str
     to_currency: str
     amount: str = ""
-    # Calling the API
-    def convert(self, API_KEY: str) -> dict:
-        URL = f"https://v6.exchangerate-api.com/v6/{API_KEY}/pair/{self.from_currency}/{self.to_currency}/{self.amount}"
-        response = requests.get(URL)
-        return response.json()
+    # The API is only called if the cached rates are too old
+    async def convert(self, API_KEY: str) -> dict:
+        table = await rates.get_table(API_KEY)
+        conversion_rate = table.rate(self.from_currency, self.to_currency)
+        result = {
+            "conversion_rate": conversion_rate,
+            "freshness": rates.freshness(table)
+        }
+        if self.amount != "":
+            result["conversion_result"] = float(self.amount) * conversion_rate
+        return result
 
 
 def is_valid_exchange_query(message: str) -> tuple[bool, int]:
@@ -66,22 +73,22 @@ def parse_exchange_query(message: str) -> Exchange_Query:
         raise InvalidExchangeQueryError("Invalid exchange query")
 
 
-def handle_exchange_query(update: Update, API_KEY: str) -> None:
+async def handle_exchange_query(update: Update, API_KEY: str) -> None:
     """Send conversion rate (of a number) from one currency to another"""
     try:
         query: Exchange_Query = parse_exchange_query(update.message.text)
-        result_obj = query.convert(API_KEY)
+        result_obj = await query.convert(API_KEY)
         base_symbol = f"{symbols[query.from_currency]}"
         target_symbol = f"{symbols[query.to_currency]}"
         conversion_rate = f"{float(result_obj['conversion_rate'])}"
         if query.amount == "":
-            update.message.reply_text(f"{base_symbol}1 = {target_symbol}{float(conversion_rate):.2f}")
+            await update.message.reply_text(f"{base_symbol}1 = {target_symbol}{float(conversion_rate):.2f}\n{result_obj['freshness']}")
         else:
             conversion_result = f"{float(result_obj['conversion_result'])}"
-            update.message.reply_text(f"{base_symbol}{query.amount} = {target_symbol}{float(conversion_result):.1f}" + f" ({base_symbol}1 = {target_symbol}{float(conversion_rate):.2f})")
+            await update.message.reply_text(f"{base_symbol}{query.amount} = {target_symbol}{float(conversion_result):.1f}" + f" ({base_symbol}1 = {target_symbol}{float(conversion_rate):.2f})\n{result_obj['freshness']}")
         
     except (InvalidExchangeQueryError):
-        update.message.reply_text("❌Ошибка в записи запроса❌")
-    except (requests.ConnectionError, requests.Timeout):
-        update.message.reply_text("❌Ошибка при подключении к API курсов валют. Попробуйте позже.")
+        await update.message.reply_text("❌Ошибка в записи запроса❌")
+    except rates.RatesUnavailable:
+        await update.message.reply_text("❌Ошибка при подключении к API курсов валют. Попробуйте позже.")
 
@@ -1,31 +1,46 @@
-from telegram.update import Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 
+from collections import OrderedDict
 from typing import NamedTuple
 import datetime
-import json
+import itertools
+import os
+import threading
 
-from balance import get_balance, set_balance
+from balance import change_balance, wait_for_balance
+from storage import data_root, get_storage
+from transaction import transaction
+import blocking
+import category_index
 import db
 
 
-def fix_category(category: str):
+# Expenses waiting for confirmation of a guessed category, the oldest are forgotten
+MAX_PENDING = 100
+
+# Id -> (data directory of the user, expense, guessed category)
+_pending: OrderedDict[str, tuple[str, "Expense", str]] = OrderedDict()
+_pending_lock = threading.Lock()
+_pending_ids = itertools.count()
+
+
+def fix_category(category: str, fuzzy: bool = True):
     """
-    Replace category with a proper name if it's an alias or with \"Other\" if not, or, if categories file doesn't exist, create one and add \"Other\" to it.
+    Replace category with a proper name if it's an alias (or a misspelled alias, if fuzzy) or with \"Other\" if not, or, if categories file doesn't exist, create one and add \"Other\" to it.
     """
     # If categories.json file exists
     try:
-        with open("categories.json", "r", encoding="utf8") as f:
-            categories: dict[str, list[str]] = json.load(f)
-
-        for k, v in categories.items():
-            if category.lower() in v:
-                fixed_category = k
-                return fixed_category
+        resolve = category_index.resolve_fuzzy if fuzzy else category_index.resolve
+        if (fixed_category := resolve(category)) is not None:
+            return fixed_category
     # Create file and insert "Other" in it, if it doens't already exist
     except FileNotFoundError:
-        with open("categories.json", "a", encoding="utf8") as f:
-            categories = json.dumps({"Другое": ["другое"]}, indent=4, ensure_ascii=False)
-            f.write(categories)
+        with transaction("categories"):
+            try:
+                get_storage().load_categories()
+            except FileNotFoundError:
+                get_storage().save_categories({"Другое": ["другое"]})
+                category_index.invalidate()
 
     fixed_category = "Другое"
     return fixed_category
@@ -85,7 +100,7 @@ def is_valid_expense(message: str) -> tuple[bool, int]:
     return (False, 0)
 
 
-def parse_expense(message: str) -> Expense:
+def parse_expense(message: str, fuzzy: bool = True) -> Expense:
     """Constructing Expense object or throwing an error, depending on syntax validity"""
     if (validity := is_valid_expense(message))[0] == True:
         # If no description:
@@ -104,7 +119,7 @@ def parse_expense(message: str) -> Expense:
                 description = " ".join(description)
                 fixed_description = description
         
-        fixed_category = fix_category(category)
+        fixed_category = fix_category(category, fuzzy)
         capitalized_category = capitalize_string(category)
         fixed_description = f"{capitalized_category} {fixed_description}".rstrip()
 
@@ -116,37 +131,135 @@ def parse_expense(message: str) -> Expense:
         raise InvalidExpenseError("Invalid expense syntax")
 
 
-def handle_expense(update: Update) -> None:
+def save_expense(expense: Expense) -> str:
+    """Add expense to database, set new balance and construct the reply"""
+    reason = f"expense {expense.category} {expense.description}".rstrip()
+    with transaction("balance", f"month:{db.current_month()}") as tx:
+        # Calculating and setting new balance, its fsync is awaited after the locks are released
+        new_balance = change_balance(-expense.money, reason, wait=False)
+        tx.on_rollback(lambda: change_balance(expense.money, f"rollback {reason}"))
+
+        # Add the expense to the database (csv file of the current month)
+        db.add_expense(expense)
+    wait_for_balance()
+
+    # Construct the reply depending on the description
+    exp = f"Добавлен расход:\n-{expense.money} {expense.category}\n"
+    bl = f"🌠 Баланс: {new_balance} грн"
+    desc = ""
+    if expense.description == "":
+        desc = "🎇 Без описания.\n"
+    else:
+        desc = f"🎇 Описание: {expense.description}\n"
+    return exp + desc + bl
+
+
+def parse_batch(lines: list[str]) -> tuple[list[Expense], list[str]]:
+    """Parse every line as an expense, get the valid expenses and the rejected lines"""
+    expenses, rejected = [], []
+    for line in lines:
+        try:
+            expenses.append(parse_expense(line))
+        except InvalidExpenseError:
+            rejected.append(line.strip())
+    return expenses, rejected
+
+
+def save_batch(lines: list[str]) -> str:
+    """Add valid expenses of the lines with one write and one balance change, construct the summary"""
+    expenses, rejected = parse_batch(lines)
+
+    reply = []
+    if expenses:
+        total = sum(expense.money for expense in expenses)
+        reason = f"expenses batch of {len(expenses)}"
+        with transaction("balance", f"month:{db.current_month()}") as tx:
+            new_balance = change_balance(-total, reason, wait=False)
+            tx.on_rollback(lambda: change_balance(total, f"rollback {reason}"))
+
+            db.add_expenses(expenses)
+        wait_for_balance()
+
+        by_category = {}
+        for expense in expenses:
+            by_category[expense.category] = by_category.get(expense.category, 0) + expense.money
+        reply.append(f"Добавлено расходов: {len(expenses)}, на сумму {total} грн")
+        reply.extend(f"-{money} {category}" for category, money in by_category.items())
+        reply.append(f"🌠 Баланс: {new_balance} грн")
+
+    if rejected:
+        reply.append(f"\n❌ Ошибка в записи расхода, не добавлено строк: {len(rejected)}")
+        reply.extend(rejected)
+    # Rejected lines can't make the reply longer than Telegram allows, the message itself fits into it
+    return "\n".join(reply).strip()[:4096]
+
+
+async def ask_category(update: Update, expense: Expense, category: str, suggested: str) -> None:
+    """Keep the expense until the user confirms or rejects the guessed category"""
+    with _pending_lock:
+        pending_id = str(next(_pending_ids))
+        _pending[pending_id] = (data_root(), expense, suggested)
+        if len(_pending) > MAX_PENDING:
+            _pending.popitem(last=False)
+
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"✅ {suggested}", callback_data=f"fuzzy_category:{pending_id}:1"),
+        InlineKeyboardButton(f"❌ {expense.category}", callback_data=f"fuzzy_category:{pending_id}:0")
+    ]])
+    await update.message.reply_text(f"🤔 Категория \"{category}\" не найдена. Может быть, {suggested}?", reply_markup=keyboard)
+
+
+async def handle_category_choice(update: Update) -> None:
+    """Add the pending expense with the guessed category or with the original one"""
+    query = update.callback_query
+    command, pending_id, accepted = query.data.split(":")
+    await query.answer()
+
+    with _pending_lock:
+        # Buttons of one user can't add expenses of another one
+        if pending_id in _pending and _pending[pending_id][0] == data_root():
+            pending = _pending.pop(pending_id)
+        else:
+            pending = None
+    if pending is None:
+        await query.edit_message_text("❌ Расход уже добавлен или устарел")
+        return
+
+    root, expense, suggested = pending
+    if accepted == "1":
+        expense = expense._replace(category=suggested)
+    await query.edit_message_text(await blocking.run(save_expense, expense))
+
+
+async def handle_expense(update: Update) -> None:
     """Check message validity, add expense to database and set new balance"""
     try:
         message = update.message.text    
 
         # Checking if function is called by Command Handler instead of Message Handler
         if message == "/expense":
-            update.message.reply_text("❌ Ошибка в записи расхода")
+            await update.message.reply_text("❌ Ошибка в записи расхода")
             return
         if message.split()[0] == "/expense":
-            message = " ".join(message.split()[1:])
+            message = message.split(maxsplit=1)[1]
 
-        # Getting Expense Object
-        expense: Expense = parse_expense(message)
+        # Every line is an expense, all of them are added at once, misspelled categories are fixed silently
+        if len(lines := [line for line in message.splitlines() if line.strip()]) > 1:
+            await update.message.reply_text(await blocking.run(save_batch, lines))
+            return
 
-        # Calculating and setting new balance
-        new_balance = get_balance() - expense.money
-        set_balance(new_balance)
+        # Getting Expense Object, misspelled categories are either fixed silently or confirmed by the user
+        confirm = os.getenv("FUZZY_CONFIRM", "0") == "1"
+        expense: Expense = await blocking.run(parse_expense, message, fuzzy=not confirm)
 
-        # Add the expense to the database (csv file of the current month)
-        db.add_expense(expense)
+        if confirm and expense.category == "Другое":
+            category = message.split()[1]
+            suggested = await blocking.run(category_index.resolve_fuzzy, category)
+            if suggested is not None and suggested != expense.category:
+                await ask_category(update, expense, category, suggested)
+                return
 
-        # Construct the reply depending on the description
-        exp = f"Добавлен расход:\n-{expense.money} {expense.category}\n"
-        bl = f"🌠 Баланс: {new_balance} грн"
-        desc = ""
-        if expense.description == "":
-            desc = "🎇 Без описания.\n"
-        else:
-            desc = f"🎇 Описание: {expense.description}\n"
-        update.message.reply_text(exp + desc + bl)
+        await update.message.reply_text(await blocking.run(save_expense, expense))
 
     except InvalidExpenseError:
-        update.message.reply_text("❌ Ошибка в записи расхода")
\ No newline at end of file
+        await update.message.reply_text("❌ Ошибка в записи расхода")
\ No newline at end of file
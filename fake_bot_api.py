@@ -0,0 +1,229 @@
+"""
+Local fake of the Telegram Bot API for checking the bot end to end without Telegram.
+
+Starts the fake API on a free port and runs main.py against it (TELEGRAM_API_URL) in a
+temporary directory. Synthetic updates are pushed to the webhook the bot registers, or
+served by getUpdates in polling mode. Replies are collected from sendMessage and friends
+and checked, then the bot is stopped with "q" on its stdin. In webhook mode an update
+with a wrong secret token must be rejected.
+
+Usage: python fake_bot_api.py [webhook|polling]
+"""
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+USER_ID = 1
+TIMEOUT = 30
+
+# Message -> text the reply must contain
+SCENARIO = [
+    ("bl 1000", "Баланс: 1000 грн"),
+    ("100 taxi", "Баланс: 900 грн"),
+    ("+ 50 salary", "Баланс: 950 грн"),
+    ("bl", "Баланс: 950 грн"),
+    ("find taxi", "Найдено: 1"),
+]
+
+
+class FakeBotApi:
+    """State shared by the request handlers: queued updates, registered webhook and sent replies"""
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.updates: list[dict] = []
+        self.webhook: dict | None = None
+        self.sent: list[tuple[float, str, str]] = []
+        self.message_ids = iter(range(1000, 10 ** 9))
+
+    def message(self, text: str = "") -> dict:
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "text": text,
+                "chat": {"id": USER_ID, "type": "private"}}
+
+    def call(self, method: str, params: dict) -> object:
+        """Result of a Bot API method"""
+        match method:
+            case "getMe":
+                return {"id": 42, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+                        "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+            case "setWebhook":
+                with self.lock:
+                    self.webhook = params
+                    self.lock.notify_all()
+                return True
+            case "getUpdates":
+                return self.get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+            case "sendMessage" | "editMessageText" | "sendPhoto" | "sendDocument":
+                text = params.get("text", params.get("caption", ""))
+                with self.lock:
+                    self.sent.append((time.perf_counter(), method, text))
+                    self.lock.notify_all()
+                return self.message(text)
+            case _:
+                return True
+
+    def get_updates(self, offset: int, timeout: float) -> list[dict]:
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.lock.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+    def wait_for(self, predicate, timeout: float = TIMEOUT):
+        with self.lock:
+            return self.lock.wait_for(predicate, timeout)
+
+
+def make_handler(api: FakeBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            # Path is /bot{token}/{method}
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            params = {}
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params = {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+            response = json.dumps({"ok": True, "result": api.call(method, params)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_update(update_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"}
+    }}
+
+
+def push(url: str, update: dict, secret: str) -> int:
+    """POST the update to the webhook like Telegram does, get the HTTP status"""
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST", headers={
+        "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret
+    })
+    # The webhook is registered right before its server starts listening
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except urllib.error.URLError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run(mode: str) -> list[str]:
+    """Run the scenario against the bot, get the problems found"""
+    api = FakeBotApi()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    webhook_port = free_port()
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": "123:fake",
+        "TELEGRAM_USER_ID": str(USER_ID),
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{server.server_port}",
+        "BOT_MODE": mode,
+        "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}",
+        "WEBHOOK_PORT": str(webhook_port),
+        "WEBHOOK_SECRET": secrets.token_urlsafe(16),
+        "PREWARM": "0",
+        "PREFETCH_RATES": "0"
+    }
+    problems = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")],
+                               cwd=tmp, env=env, stdin=subprocess.PIPE, text=True)
+        try:
+            if mode == "webhook":
+                if not api.wait_for(lambda: api.webhook is not None):
+                    return ["bot never registered its webhook"]
+                url, secret = api.webhook["url"], api.webhook.get("secret_token", "")
+                if secret != env["WEBHOOK_SECRET"]:
+                    problems.append("webhook registered without the secret token")
+                if (status := push(url, synthetic_update(1, "bl"), "wrong")) != 403:
+                    problems.append(f"update with a wrong secret got {status} instead of 403")
+                print("Webhook mode, updates are pushed")
+            else:
+                print("Polling mode, updates are served by getUpdates")
+
+            latencies = []
+            for index, (text, expected) in enumerate(SCENARIO):
+                # One update at a time, so every reply belongs to the last update
+                replied = len(api.sent)
+                start = time.perf_counter()
+                update = synthetic_update(index + 2, text)
+                if mode == "webhook":
+                    push(url, update, secret)
+                else:
+                    with api.lock:
+                        api.updates.append(update)
+                        api.lock.notify_all()
+
+                if not api.wait_for(lambda: len(api.sent) > replied):
+                    problems.append(f"no reply to {text!r}")
+                    continue
+                sent_at, method, reply = api.sent[replied]
+                latencies.append(sent_at - start)
+                if expected not in reply:
+                    problems.append(f"reply to {text!r} is {reply!r}, expected {expected!r}")
+
+            if latencies:
+                print(f"{len(latencies)} replies, latency avg {sum(latencies) / len(latencies) * 1e3:.0f} ms, max {max(latencies) * 1e3:.0f} ms")
+            if mode == "webhook" and len(api.sent) != len(latencies):
+                problems.append("update with a wrong secret was handled")
+        finally:
+            try:
+                bot.communicate("q\n", timeout=15)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+                problems.append("bot didn't stop on \"q\"")
+            server.shutdown()
+    return problems
+
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else "webhook"
+    problems = run(mode)
+    for problem in problems:
+        print(f"FAILED {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"OK: {mode} mode works end to end")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Offline check of historical exchange rates against a local fixture instead of the API.
+
+Writes a RATES_HISTORY_FIXTURE with a different USD rate for every day of a month in a
+temporary directory, backfills the month from it and converts its expenses: every expense
+must be converted at the rate of its own day and a second backfill must add nothing.
+Then the converted month is asked for with a missing and with a corrupt fixture, and the
+handler must reply with an error instead of throwing.
+
+Usage: python fake_rate_history.py
+"""
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import db
+import month as month_handlers
+import rate_history
+
+
+MONTH = "2024.02"
+DAYS = 29
+# (day, money) of the expenses of the month
+EXPENSES = [(1, 100), (3, 250), (3, 40), (17, 1000), (29, 75)]
+
+
+def usd_rate(day: int) -> float:
+    return round(0.025 + day * 0.0001, 6)
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies: list[str] = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+
+async def reply_to_converted_month(month: str) -> str:
+    """Ask for the month in USD like the handler does, get the reply"""
+    message = FakeMessage()
+    await month_handlers.handle_converted_month(SimpleNamespace(message=message), month, "usd")
+    return message.replies[-1] if message.replies else ""
+
+
+def check() -> list[str]:
+    problems = []
+    fixture = os.path.join(os.getcwd(), "fixture.json")
+    with open(fixture, "w", encoding="utf8") as f:
+        json.dump({f"{MONTH}.{day:02}": {"USD": usd_rate(day), "EUR": 0.023} for day in range(1, DAYS + 1)}, f)
+    os.environ["RATES_HISTORY_FIXTURE"] = fixture
+
+    storage = db.get_storage()
+    storage.save_categories({"Еда": ["food"]})
+    storage.add_expenses(MONTH, [SimpleNamespace(date=f"{MONTH}.{day:02}", money=money, category="Еда", description="")
+                                 for day, money in EXPENSES])
+
+    if (added := asyncio.run(rate_history.backfill_month(MONTH))) != DAYS:
+        problems.append(f"backfill added {added} days instead of {DAYS}")
+    if (added := asyncio.run(rate_history.backfill_month(MONTH))) != 0:
+        problems.append(f"second backfill added {added} days")
+
+    stat = db.converted_month_stat(MONTH, "usd")
+    expected = round(sum(money * usd_rate(day) for day, money in EXPENSES), 2)
+    if stat["total"] != expected or stat["quantity"] != len(EXPENSES):
+        problems.append(f"converted total is {stat['total']} of {stat['quantity']} expenses, expected {expected} of {len(EXPENSES)}")
+    print(f"{MONTH}: {stat['quantity']} expenses, {stat['total']} USD")
+
+    # Days of the next month aren't known, so the fixture is read again
+    next_month = (datetime.date(2024, 2, 1) + datetime.timedelta(days=32)).strftime("%Y.%m")
+    os.environ["RATES_HISTORY_FIXTURE"] = os.path.join(os.getcwd(), "missing.json")
+    if not (reply := asyncio.run(reply_to_converted_month(next_month))).startswith("❌"):
+        problems.append(f"missing fixture got reply {reply!r}")
+
+    with open(fixture, "w", encoding="utf8") as f:
+        f.write("{not json")
+    os.environ["RATES_HISTORY_FIXTURE"] = fixture
+    if not (reply := asyncio.run(reply_to_converted_month(next_month))).startswith("❌"):
+        problems.append(f"corrupt fixture got reply {reply!r}")
+    return problems
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            problems = check()
+        except Exception as e:
+            problems = [f"check failed: {e!r}"]
+        finally:
+            db.get_storage().close()
+
+    for problem in problems:
+        print(f"FAILED {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: backfill from the fixture and conversion at the rate of every day work")
+
+
+if __name__ == "__main__":
+    main()
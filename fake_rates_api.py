@@ -0,0 +1,178 @@
+"""
+Local stub of the exchange rates API for checking the HTTP client without the network.
+
+Starts the stub on a free port and runs HttpClient (http_client.py) against it: failed
+requests are retried with backoff, the circuit opens after FAILURE_THRESHOLD failed
+requests in a row and rejects requests without asking the stub, a cancelled trial request
+doesn't keep it open, a request sent before the circuit opened and failing during the trial
+lets no second trial through, and a successful trial after RESET_AFTER seconds closes it.
+Backoff and RESET_AFTER are shortened, so the check takes a couple of seconds.
+
+The first part of the path tells the stub how to answer: "flaky" fails the next fail_next
+requests, "slow-fail" answers 503 after SLOW seconds and "slow-ok" 200 after 5 * SLOW.
+
+Usage: python fake_rates_api.py
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+import http_client
+from http_client import CircuitOpen, HttpClient
+
+
+RATES = {"result": "success", "conversion_rates": {"UAH": 1, "USD": 0.025, "EUR": 0.023}}
+SLOW = 0.3
+
+
+class FakeRatesApi:
+    """Behaviour of the stub: how many next requests fail and how long every request takes"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fail_next = 0
+        self.delay = 0.0
+        self.requests = 0
+
+    def respond(self, path: str) -> tuple[int, dict]:
+        behaviour = path.strip("/").split("/")[0]
+        with self.lock:
+            self.requests += 1
+            delay = self.delay
+            failed = self.fail_next > 0
+            if failed and behaviour == "flaky":
+                self.fail_next -= 1
+        if behaviour == "slow-fail":
+            delay, failed = SLOW, True
+        elif behaviour == "slow-ok":
+            delay, failed = 5 * SLOW, False
+        time.sleep(delay)
+        return (503, {"result": "error"}) if failed else (200, RATES)
+
+
+def make_handler(api: FakeRatesApi):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = api.respond(self.path)
+            response = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            try:
+                self.wfile.write(response)
+            except (BrokenPipeError, ConnectionResetError):
+                # The request was cancelled by the client
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+async def check(api: FakeRatesApi, url: str) -> list[str]:
+    """Run the client against the stub, get the problems found"""
+    problems = []
+    client = HttpClient(url)
+
+    # Failures shorter than the retries are hidden from the caller
+    api.fail_next = http_client.RETRIES
+    response = await client.get("flaky/latest/UAH")
+    if response.status_code != 200 or client.counters["retries"] != http_client.RETRIES:
+        problems.append(f"retried request got {response.status_code} after {client.counters['retries']} retries")
+
+    # Every request fails after all of its retries, then the circuit opens
+    api.fail_next = 10 ** 6
+    for _ in range(http_client.FAILURE_THRESHOLD):
+        if (response := await client.get("flaky/latest/UAH")).status_code != 503:
+            problems.append(f"failed request got {response.status_code}")
+    if client.stats()["circuit"] != "open":
+        problems.append(f"circuit is closed after {http_client.FAILURE_THRESHOLD} failed requests")
+
+    asked = api.requests
+    try:
+        await client.get("flaky/latest/UAH")
+        problems.append("open circuit didn't reject the request")
+    except CircuitOpen:
+        pass
+    if api.requests != asked:
+        problems.append("open circuit asked the API")
+
+    # The trial request is cancelled halfway, the next one must become the trial
+    await asyncio.sleep(http_client.RESET_AFTER)
+    api.fail_next, api.delay = 0, 1.0
+    trial = asyncio.create_task(client.get("flaky/latest/UAH"))
+    await asyncio.sleep(0.2)
+    trial.cancel()
+    await asyncio.gather(trial, return_exceptions=True)
+
+    api.delay = 0.0
+    try:
+        response = await client.get("flaky/latest/UAH")
+        if response.status_code != 200 or client.stats()["circuit"] != "closed":
+            problems.append(f"successful trial got {response.status_code} and left the circuit {client.stats()['circuit']}")
+    except CircuitOpen:
+        problems.append("circuit stays open after the trial request was cancelled")
+
+    print(client.stats())
+    return problems + await check_late_request(api, url)
+
+
+async def check_late_request(api: FakeRatesApi, url: str) -> list[str]:
+    """A request sent before the circuit opened fails during the trial, no second trial may get through"""
+    problems = []
+    client = HttpClient(url)
+    late = asyncio.create_task(client.get("slow-fail/latest/UAH"))
+    await asyncio.sleep(0.05)
+
+    api.fail_next = 10 ** 6
+    for _ in range(http_client.FAILURE_THRESHOLD):
+        await client.get("flaky/latest/UAH")
+    await asyncio.sleep(http_client.RESET_AFTER)
+
+    # The trial answers after the late request has failed and RESET_AFTER more seconds have passed,
+    # so neither a freed trial nor a circuit reopened by the late failure may let a request through
+    trial = asyncio.create_task(client.get("slow-ok/latest/UAH"))
+    await asyncio.sleep(0.05)
+    await asyncio.gather(late, return_exceptions=True)
+    await asyncio.sleep(http_client.RESET_AFTER)
+    try:
+        await client.get("flaky/latest/UAH")
+        problems.append("second trial got through while the first one was running")
+    except CircuitOpen:
+        pass
+
+    if (response := await trial).status_code != 200 or client.stats()["circuit"] != "closed":
+        problems.append(f"trial got {response.status_code} and left the circuit {client.stats()['circuit']}")
+    api.fail_next = 0
+    return problems
+
+
+def main():
+    http_client.BACKOFF = 0.01
+    http_client.RESET_AFTER = 0.5
+
+    api = FakeRatesApi()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        problems = asyncio.run(check(api, f"http://127.0.0.1:{server.server_port}"))
+    except httpx.HTTPError as e:
+        problems = [f"request failed: {e!r}"]
+    finally:
+        server.shutdown()
+
+    for problem in problems:
+        print(f"FAILED {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: retries, circuit breaker and trial request work")
+
+
+if __name__ == "__main__":
+    main()
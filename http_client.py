@@ -0,0 +1,155 @@
+"""
+Shared HTTP client of the exchange rates API.
+
+All requests go through one httpx.AsyncClient, so connections are kept alive and pooled
+and waiting for the API never blocks the event loop. Every request has strict connect
+and read timeouts and is retried a bounded number of times with exponential backoff and
+jitter. After FAILURE_THRESHOLD requests in a row have failed the circuit opens and
+requests fail fast with CircuitOpen, until a single trial request after RESET_AFTER
+seconds succeeds.
+
+The base URL is taken from EXCHANGE_API_URL, so the client can be pointed at a local stub.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+RETRIES = 2
+BACKOFF = 0.3
+FAILURE_THRESHOLD = 5
+RESET_AFTER = 30
+
+# Status codes worth asking again, anything else is the final answer
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """Custom exception to be thrown instead of a request while the API is considered down"""
+    pass
+
+
+class HttpClient:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        # Connections belong to the event loop they were opened in
+        self._client: httpx.AsyncClient | None = None
+        self._client_loop: asyncio.AbstractEventLoop | None = None
+
+        self._lock = threading.Lock()
+        # Circuit breaker: failures in a row and the time the circuit was opened at
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+
+        self.counters = {"requests": 0, "errors": 0, "retries": 0, "rejected": 0, "circuit_opened": 0}
+        self._latencies: deque[float] = deque(maxlen=200)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8)
+            )
+            self._client_loop = loop
+        return self._client
+
+    def allow(self) -> bool:
+        """Throw CircuitOpen unless the circuit is closed or it's time for a trial request, get whether it's the trial"""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at >= RESET_AFTER and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.counters["rejected"] += 1
+        raise CircuitOpen(f"{self.base_url} failed {self._failures} times in a row")
+
+    def record(self, success: bool, trial: bool = False) -> None:
+        with self._lock:
+            if not success:
+                self.counters["errors"] += 1
+            # Requests sent before the circuit opened finish late, only the trial closes or reopens it
+            if self._opened_at is not None and not trial:
+                return
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= FAILURE_THRESHOLD and self._opened_at is None:
+                self.counters["circuit_opened"] += 1
+            if self._failures >= FAILURE_THRESHOLD or trial:
+                self._opened_at = time.monotonic()
+
+    async def get(self, path: str) -> httpx.Response:
+        """GET base_url/path with timeouts, retries and the circuit breaker"""
+        trial = self.allow()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        try:
+            for attempt in range(RETRIES + 1):
+                if attempt > 0:
+                    with self._lock:
+                        self.counters["retries"] += 1
+                    await asyncio.sleep(BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+                start = time.perf_counter()
+                with self._lock:
+                    self.counters["requests"] += 1
+                try:
+                    response = await self.client.get(url)
+                except httpx.HTTPError:
+                    if attempt == RETRIES:
+                        self.record(False, trial)
+                        raise
+                    continue
+                finally:
+                    with self._lock:
+                        self._latencies.append(time.perf_counter() - start)
+
+                if response.status_code in RETRY_STATUSES and attempt < RETRIES:
+                    continue
+                self.record(response.status_code not in RETRY_STATUSES, trial)
+                return response
+        finally:
+            # Only the trial itself lets the next one through, however it ends: a cancelled trial
+            # or one failed by anything but HTTP leaves the circuit open and the next request becomes the trial
+            if trial:
+                with self._lock:
+                    self._trial_running = False
+
+    async def get_json(self, path: str) -> dict:
+        return (await self.get(path)).json()
+
+    def stats(self) -> dict:
+        """Counters and latency percentiles of recent requests in milliseconds"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {**self.counters, "circuit": "open" if self._opened_at is not None else "closed"}
+        if latencies:
+            stats["p50_ms"] = round(latencies[len(latencies) // 2] * 1e3, 1)
+            stats["p95_ms"] = round(latencies[int(len(latencies) * 0.95)] * 1e3, 1)
+        return stats
+
+
+_client: HttpClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """Get the client of the exchange rates API, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(os.getenv("EXCHANGE_API_URL", "https://v6.exchangerate-api.com/v6"))
+        return _client
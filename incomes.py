@@ -1,6 +1,7 @@
 from typing import NamedTuple
-from telegram.update import Update
-from balance import get_balance, set_balance
+from telegram import Update
+from balance import change_balance
+import blocking
 
 
 class InvalidIncomeError(Exception):
@@ -41,17 +42,16 @@ def parse_income(message: str) -> Income:
         raise InvalidIncomeError("Invalid income syntax")
 
 
-def handle_income(update: Update) -> None:
+async def handle_income(update: Update) -> None:
     """Check message validity and set new balance"""
     try:
         # Getting Income object
         income: Income = parse_income(update.message.text)
 
         # Calculating and setting new balance
-        new_balance = get_balance() + income.money
-        set_balance(new_balance)
+        new_balance = await blocking.run(change_balance, income.money, f"income {income.source}".rstrip())
 
-        update.message.reply_text(f"Добавлен доход:\n+{income.money} {income.source}\n🌠 Баланс: {new_balance} грн")
+        await update.message.reply_text(f"Добавлен доход:\n+{income.money} {income.source}\n🌠 Баланс: {new_balance} грн")
 
     except InvalidIncomeError:
-        update.message.reply_text("❌ Ошибка в записи дохода")
+        await update.message.reply_text("❌ Ошибка в записи дохода")
@@ -0,0 +1,316 @@
+"""
+Write-ahead ledger of the balance.
+
+Every change of the balance is appended to ledger/log.jsonl of the data directory as
+{"seq", "time", "delta", "balance", "reason"}, so the current balance is only kept in memory
+and the log shows how it got there. Appends are made durable by group commit: a flusher
+thread fsyncs the log once per LEDGER_FSYNC_WINDOW_MS milliseconds for all changes made
+in that window, and every change waits for the fsync covering it before it's reported
+(changes made while holding other locks can skip the wait and call wait() after releasing them).
+A snapshot of the balance and the log offset it covers is written every SNAPSHOT_EVERY
+entries, so startup only replays the tail of the log.
+
+The log is also the balance history. Every CHECKPOINT_EVERY entries the time and offset
+of an entry are appended to ledger/checkpoints.jsonl, which is kept in memory sorted by
+time, so the balance at any moment is found by a bisect over the checkpoints and reading
+at most CHECKPOINT_EVERY entries after it.
+
+The ledger is shared by both storage backends, the balance kept by the storage is only
+read once to start the ledger of an existing data directory.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from storage import data_root, get_storage, write_atomically
+
+
+SNAPSHOT_EVERY = 1000
+CHECKPOINT_EVERY = 256
+
+
+class LedgerCorrupted(Exception):
+    """Custom exception to be thrown if the ledger doesn't add up to the balances it records"""
+    pass
+
+
+def fsync_window() -> float:
+    """Seconds changes are batched for before an fsync, 0 syncs every change on its own"""
+    return int(os.getenv("LEDGER_FSYNC_WINDOW_MS", "10")) / 1000
+
+
+class Ledger:
+    def __init__(self, root: str):
+        self.root = root
+        self.window = fsync_window()
+
+        # Guards the balance and appends, the condition is notified when entries become durable
+        self._lock = threading.RLock()
+        self._synced = threading.Condition(self._lock)
+        self._balance: int | None = None
+        self._seq = 0
+        self._durable_seq = 0
+        self._entries_since_snapshot = 0
+        self._flusher: threading.Thread | None = None
+        self._closed = False
+        # Time of the last entry, entries never go back in time even if the clock does
+        self._last_time = 0.0
+        # [time, seq, offset] of every checkpoint and their times for bisect
+        self._checkpoints: list[list] = []
+        self._checkpoint_times: list[float] = []
+
+        os.makedirs(os.path.join(root, "ledger"), exist_ok=True)
+        self.recover()
+        self.load_checkpoints()
+        self._file = open(self.log_path, "ab")
+
+        # Starting the ledger of a data directory which only has the old balance
+        if self._balance is None:
+            try:
+                self.set(get_storage().get_balance(), "import")
+            except (IOError, ValueError):
+                pass
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.root, "ledger", "log.jsonl")
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.root, "ledger", "snapshot.json")
+
+    @property
+    def checkpoints_path(self) -> str:
+        return os.path.join(self.root, "ledger", "checkpoints.jsonl")
+
+    def recover(self) -> None:
+        """Load the snapshot and replay the log after it, cutting off an entry torn by a crash"""
+        offset = 0
+        try:
+            with open(self.snapshot_path, "r", encoding="utf8") as f:
+                snapshot = json.load(f)
+            self._balance, self._seq, offset = snapshot["balance"], snapshot["seq"], snapshot["offset"]
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    offset += len(line)
+                    self._balance, self._seq, self._last_time = entry["balance"], entry["seq"], entry["time"]
+                    self._entries_since_snapshot += 1
+            with open(self.log_path, "r+b") as f:
+                f.truncate(offset)
+        except FileNotFoundError:
+            pass
+        self._durable_seq = self._seq
+
+    def load_checkpoints(self) -> None:
+        """Load checkpoints of the log or index the whole log if there are none yet"""
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            log_size = 0
+
+        try:
+            with open(self.checkpoints_path, "r", encoding="utf8") as f:
+                lines = f.readlines()
+            checkpoints = []
+            for line in lines:
+                try:
+                    checkpoints.append(json.loads(line))
+                except ValueError:
+                    break
+        except FileNotFoundError:
+            checkpoints = []
+            offset = 0
+            try:
+                with open(self.log_path, "rb") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if (entry["seq"] - 1) % CHECKPOINT_EVERY == 0:
+                            checkpoints.append([entry["time"], entry["seq"], offset])
+                        offset += len(line)
+            except FileNotFoundError:
+                pass
+            write_atomically(self.checkpoints_path, "".join(json.dumps(c) + "\n" for c in checkpoints))
+
+        # Checkpoints of entries lost in a crash point past the end of the log
+        self._checkpoints = [c for c in checkpoints if c[2] < log_size]
+        self._checkpoint_times = [c[0] for c in self._checkpoints]
+        if self._checkpoints:
+            self._last_time = max(self._last_time, self._checkpoints[-1][0])
+
+    @property
+    def balance(self) -> int:
+        """Current balance or throw IOError if it isn't set yet"""
+        with self._lock:
+            if self._balance is None:
+                raise FileNotFoundError("Balance is not set yet")
+            return self._balance
+
+    def append(self, delta: int, balance: int, reason: str, wait: bool = True) -> int:
+        """Write the entry and wait until it's durable, unless told not to"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._last_time = max(time.time(), self._last_time)
+            entry = {"seq": seq, "time": self._last_time, "delta": delta, "balance": balance, "reason": reason}
+
+            if (seq - 1) % CHECKPOINT_EVERY == 0:
+                checkpoint = [self._last_time, seq, self._file.tell()]
+                with open(self.checkpoints_path, "a", encoding="utf8") as f:
+                    f.write(json.dumps(checkpoint) + "\n")
+                self._checkpoints.append(checkpoint)
+                self._checkpoint_times.append(self._last_time)
+
+            self._file.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf8"))
+            self._balance = balance
+
+            self._entries_since_snapshot += 1
+            if self._entries_since_snapshot >= SNAPSHOT_EVERY:
+                self.save_snapshot()
+
+            if self.window == 0:
+                self.sync()
+                return balance
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self.flush_loop, daemon=True)
+                self._flusher.start()
+            self._synced.notify_all()
+            if wait:
+                self.wait(seq)
+        return balance
+
+    def wait(self, seq: int | None = None) -> None:
+        """Block until the entry with seq (every entry appended so far by default) is durable"""
+        with self._lock:
+            seq = self._seq if seq is None else seq
+            while self._durable_seq < seq:
+                self._synced.wait()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._durable_seq = self._seq
+
+    def flush_loop(self) -> None:
+        """Fsync everything appended during the window, then wake up all changes waiting for it"""
+        while True:
+            with self._lock:
+                while self._durable_seq == self._seq and not self._closed:
+                    self._synced.wait()
+                if self._closed:
+                    return
+            time.sleep(self.window)
+            with self._lock:
+                if self._closed:
+                    return
+                self.sync()
+                self._synced.notify_all()
+
+    def save_snapshot(self) -> None:
+        """Remember the balance with the log offset it covers"""
+        with self._lock:
+            self.sync()
+            snapshot = {"seq": self._seq, "balance": self._balance, "offset": self._file.tell()}
+            write_atomically(self.snapshot_path, json.dumps(snapshot))
+            self._entries_since_snapshot = 0
+
+    def set(self, new_balance: int, reason: str = "set", wait: bool = True) -> int:
+        """Override the balance by a new value"""
+        with self._lock:
+            delta = new_balance - (self._balance or 0)
+            return self.append(delta, new_balance, reason, wait)
+
+    def change(self, delta: int, reason: str, wait: bool = True) -> int:
+        """Add delta to the balance and return the new one, throw IOError if the balance isn't set yet"""
+        with self._lock:
+            return self.append(delta, self.balance + delta, reason, wait)
+
+    def entries(self) -> list[dict]:
+        """All entries of the log, oldest first"""
+        with self._lock:
+            self._file.flush()
+            with open(self.log_path, "r", encoding="utf8") as f:
+                return [json.loads(line) for line in f]
+
+    def history(self, start: float, end: float) -> tuple[int | None, list[dict]]:
+        """
+        Balance after all entries made before start (None if it wasn't set yet)
+        and the entries made from start until end, both are timestamps
+        """
+        with self._lock:
+            self._file.flush()
+            position = bisect.bisect_left(self._checkpoint_times, start) - 1
+            offset = self._checkpoints[position][2] if position >= 0 else 0
+
+        balance = None
+        entries = []
+        with open(self.log_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["time"] >= end:
+                    break
+                if entry["time"] < start:
+                    balance = entry["balance"]
+                else:
+                    entries.append(entry)
+        return balance, entries
+
+    def balance_at(self, moment: float) -> int | None:
+        """Balance right before the moment or None if it wasn't set yet"""
+        return self.history(moment, moment)[0]
+
+    def verify(self) -> int:
+        """Replay the whole log and return the balance it adds up to or throw LedgerCorrupted"""
+        balance = 0
+        for entry in self.entries():
+            balance += entry["delta"]
+            if balance != entry["balance"]:
+                raise LedgerCorrupted(f"Entry {entry['seq']} records {entry['balance']}, deltas add up to {balance}")
+        if self._balance is not None and balance != self._balance:
+            raise LedgerCorrupted(f"Balance is {self._balance}, deltas add up to {balance}")
+        return balance
+
+    def close(self) -> None:
+        """Make everything durable and stop the flusher"""
+        with self._lock:
+            self.sync()
+            self._closed = True
+            self._file.close()
+            self._synced.notify_all()
+
+
+# One ledger per data directory
+_ledgers: dict[str, Ledger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger() -> Ledger:
+    """Get ledger of the current data directory, recovering it on first use"""
+    root = data_root()
+    with _ledgers_lock:
+        if (ledger := _ledgers.get(root)) is None:
+            ledger = _ledgers[root] = Ledger(root)
+    return ledger
+
+
+def evict(root: str) -> None:
+    """Close ledger of the data directory, it's recovered again on next use"""
+    with _ledgers_lock:
+        ledger = _ledgers.pop(root, None)
+    if ledger is not None:
+        ledger.close()
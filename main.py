@@ -1,53 +1,140 @@
-# Environment variables and threading for terminal loop
+# Environment variables and asyncio for background tasks
 from dotenv import load_dotenv
+import asyncio
+import logging
 import os
-import threading
+import secrets
 
 # Telegram stuff
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 
 # My Modules
+import blocking
 import controller
 import cli
+import prefetch
+import users
 
 
-def main():
-        
-    load_dotenv()
+# Tasks running next to polling until the application stops: terminal loop and prefetch of rates
+background_tasks: list[asyncio.Task] = []
+
+
+def create_application() -> Application:
+    """Initializing the Bot and registering all handlers"""
+    application = (
+        Application.builder()
+        .token(os.getenv("TELEGRAM_BOT_TOKEN"))
+        # Can be pointed at a local Bot API server, e.g. fake_bot_api.py
+        .base_url(f"{telegram_api_url()}/bot")
+        .base_file_url(f"{telegram_api_url()}/file/bot")
+        # Handlers are coroutines, up to WORKERS updates are handled at the same time
+        .concurrent_updates(int(os.getenv("WORKERS", "8")))
+        .post_init(start_background)
+        .post_stop(stop_background)
+        .build()
+    )
+
+    # Custom Filter to filter down any requests from all users except the allowed ones
+    correct_user_filter = filters.User(user_id=users.allowed_ids())
+
+    # All handlers, blocking work inside them is done by the blocking pool, so a slow one doesn't hold up the rest
+    application.add_handler(CommandHandler("start", controller.start, filters=correct_user_filter))
+    application.add_handler(CommandHandler("help", controller.help, filters=correct_user_filter))
+    application.add_handler(CommandHandler("expense", controller.expense, filters=correct_user_filter))
+    application.add_handler(CommandHandler("income", controller.income, filters=correct_user_filter))
+    application.add_handler(CommandHandler("balance", controller.balance_query, filters=correct_user_filter))
+    application.add_handler(CommandHandler("convert", controller.convert, filters=correct_user_filter))
+    application.add_handler(CommandHandler("month", controller.month_query, filters=correct_user_filter))
+    application.add_handler(CommandHandler("year", controller.month_query, filters=correct_user_filter))
+    application.add_handler(CommandHandler("delete", controller.delete_expense, filters=correct_user_filter))
+    application.add_handler(CommandHandler("find", controller.find, filters=correct_user_filter))
+    application.add_handler(CommandHandler("categories", controller.show_categories, filters=correct_user_filter))
+    application.add_handler(CommandHandler("add_category", controller.add_category, filters=correct_user_filter))
+    application.add_handler(CommandHandler("delete_category", controller.delete_category, filters=correct_user_filter))
+    application.add_handler(MessageHandler(filters.TEXT & correct_user_filter, controller.handle_message))
+    application.add_handler(CallbackQueryHandler(controller.month_page, pattern=r"^month_page:"))
+    application.add_handler(CallbackQueryHandler(controller.fuzzy_category, pattern=r"^fuzzy_category:"))
+
+    return application
+
+
+def telegram_api_url() -> str:
+    return os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
 
-    # Initializing the Bot
-    updater = Updater(token=os.getenv("TELEGRAM_BOT_TOKEN"))
-    dp = updater.dispatcher
+def webhook_settings() -> dict | None:
+    """
+    Arguments of run_webhook when BOT_MODE is "webhook", otherwise None and updates are polled.
+    Telegram pushes updates to WEBHOOK_URL/WEBHOOK_PATH, which is usually a reverse proxy
+    in front of the embedded server on WEBHOOK_LISTEN:WEBHOOK_PORT. Requests without
+    WEBHOOK_SECRET in the X-Telegram-Bot-Api-Secret-Token header are rejected.
+    """
+    if os.getenv("BOT_MODE", "polling") != "webhook":
+        return None
+    if not (url := os.getenv("WEBHOOK_URL")):
+        print("WEBHOOK_URL is not set, falling back to polling")
+        return None
 
-    # Custom Filter to filter down any requests from all users except me (my User ID)
-    correct_user_filter = Filters.user(user_id=int(os.getenv("TELEGRAM_USER_ID")))
+    path = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+    return {
+        "listen": os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+        "port": int(os.getenv("WEBHOOK_PORT", "8443")),
+        "url_path": path,
+        "webhook_url": f"{url.rstrip('/')}/{path}",
+        # Random secret is registered anew on every start
+        "secret_token": os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    }
 
-    # All handlers
-    dp.add_handler(CommandHandler("start", controller.start, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("help", controller.help, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("expense", controller.expense, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("income", controller.income, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("balance", controller.balance_query, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("convert", controller.convert, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("month", controller.month_query, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("delete", controller.delete_expense, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("categories", controller.show_categories, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("add_category", controller.add_category, filters=correct_user_filter))
-    dp.add_handler(CommandHandler("delete_category", controller.delete_category, filters=correct_user_filter))
-    dp.add_handler(MessageHandler(Filters.text & correct_user_filter, controller.handle_message))
 
-    print("Bot running...")
+def prewarm() -> None:
+    """
+    Import libraries which are only needed for statistic and start render workers,
+    runs in background after polling has started so it doesn't delay startup.
+    """
+    # Imported only to be loaded into the process, nothing of them is used here
+    import pandas  # noqa: F401
+    import month_cache  # noqa: F401
+    import render
+    render.executor().submit(render.warm_up)
 
-    # Creating a separate thread for recieving terminal commands
-    terminal_thread = threading.Thread(target=cli.terminal_loop)
-    terminal_thread.start()
 
-    # Starting connection to Telegram servers
-    updater.start_polling(poll_interval=1, timeout=5)
+async def start_background(application: Application) -> None:
+    """Start the terminal loop and other background work once the event loop is running"""
+    background_tasks.append(asyncio.get_running_loop().create_task(cli.terminal_loop(application)))
+
+    # Keeping exchange rates warm, so conversions don't wait for the API
+    if os.getenv("EXCHANGE_RATE_API_KEY") and os.getenv("PREFETCH_RATES", "1") == "1":
+        background_tasks.append(prefetch.start(os.getenv("EXCHANGE_RATE_API_KEY")))
+
+    # PREWARM=0 leaves everything to be imported by the first request that needs it
+    if os.getenv("PREWARM", "1") == "1":
+        blocking.pool().submit(prewarm)
+
+
+async def stop_background(application: Application) -> None:
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+
+def main():
+        
+    load_dotenv()
+    # Warnings and errors of the bot and its libraries, e.g. failed rollback steps, go to stderr
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s", level=logging.WARNING)
+
+    application = create_application()
 
-    # Block main thread from dying
-    updater.idle()
+    # Both block until "q" is entered in the terminal or the process is interrupted
+    if (settings := webhook_settings()) is not None:
+        print(f"Bot running, listening for updates on {settings['listen']}:{settings['port']}...")
+        application.run_webhook(**settings)
+    else:
+        print("Bot running, polling for updates...")
+        application.run_polling(poll_interval=1, timeout=5)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
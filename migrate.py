@@ -0,0 +1,59 @@
+"""
+One-shot migration between the storage backends, run from the data directory.
+
+python migrate.py import  -> copy expenses/*.csv, balance.txt and categories.json into the SQLite file
+python migrate.py export  -> write everything from the SQLite file back into the csv layout
+
+Once the bot has started, the balance is kept by the ledger (ledger/ of the data directory),
+which is shared by both backends, so the copied balance only matters for older data directories.
+"""
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from storage import CsvStorage, SqliteStorage, MonthParseError, sqlite_path
+
+
+def copy_storage(source: CsvStorage | SqliteStorage, target: CsvStorage | SqliteStorage) -> None:
+    """Copy all months, balance and categories from one backend to another"""
+    for month in source.months():
+        try:
+            rows = source.month_rows(month)
+        except MonthParseError:
+            continue
+        target.replace_month(month, rows)
+        print(f"{month}: {len(rows)} expenses")
+
+    try:
+        target.set_balance(source.get_balance())
+    except IOError:
+        print("Balance is not set, skipping")
+
+    try:
+        target.save_categories(source.load_categories())
+    except FileNotFoundError:
+        print("Categories are not added, skipping")
+
+
+def main():
+    load_dotenv()
+    root = os.getcwd()
+    csv_storage = CsvStorage(root)
+    sqlite_storage = SqliteStorage(sqlite_path(root))
+
+    match sys.argv[1:]:
+        case ["import"]:
+            copy_storage(csv_storage, sqlite_storage)
+        case ["export"]:
+            copy_storage(sqlite_storage, csv_storage)
+        case _:
+            print(__doc__)
+            sys.exit(1)
+
+    csv_storage.close()
+    sqlite_storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
-from os import getcwd, remove
-import os.path
 import datetime
+from io import BytesIO
+from typing import Callable
 
-from telegram.update import Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
 
+import blocking
 import db
+import exchange
+import rate_history
+import rates
+import render
 from expenses import Expense
 
 
-def is_valid_month(message: str) -> bool:
+# Expenses on one page of the month listing, so it never exceeds Telegram message limit
+PAGE_SIZE = 15
+MAX_MESSAGE_LENGTH = 4096
+
+
+def is_valid_month(date: str) -> bool:
     """YYYY.MM -> True"""
-    date = message.split()[1]
     try:
         year, month = date.split(".")
         if (len(year) != 4) or (len(month) != 2):
@@ -27,56 +37,162 @@ def is_valid_month(message: str) -> bool:
     return True
 
 
-def handle_month_query(update: Update):
+def parse_period(message: str) -> tuple[str, str] | None:
+    """
+    Get first and last month of the requested period or None if syntax is invalid:\n
+    \"month YYYY.MM\" -> (YYYY.MM, YYYY.MM),\n
+    \"month YYYY.MM-YYYY.MM\" -> (YYYY.MM, YYYY.MM),\n
+    \"year YYYY\" -> (YYYY.01, YYYY.12)
+    """
+    words = message.split()
+    if len(words) != 2:
+        return None
+    command, period = words
+    if command.lower().lstrip("/") in ["year", "год"]:
+        if len(period) == 4 and period.isdigit():
+            return (f"{period}.01", f"{period}.12")
+        return None
+
+    first, sep, last = period.partition("-")
+    if not sep:
+        last = first
+    if not (is_valid_month(first) and is_valid_month(last)) or first > last:
+        return None
+    return (first, last)
+
+
+def stat_message(stat: dict) -> str:
+    msg = f"""
+Месяц: {stat["month"]}
+Всего потрачено: {stat["total"]}{" " + stat["currency"] + " (по курсу дня расхода)" if "currency" in stat else ""}
+Количество расходов: {stat["quantity"]}\n
+Самые большие расходы:
+"""
+    for index, expense in enumerate(stat['biggest_expenses']):
+        msg += f"""{index+1}. {expense['category']} {expense['money']}
+🎇 Описание: {expense['description']}
+🗓 Дата: {expense['date']}
+"""
+    return msg
+
+
+def listing_page(month: str, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Text of one page of the month expenses and buttons to the neighbouring pages"""
+    expenses, total = db.month_page(month, page * PAGE_SIZE, PAGE_SIZE)
+
+    # Page could disappear after deleting expenses, showing the last one instead
+    pages = max(1, -(-total // PAGE_SIZE))
+    if page >= pages:
+        return listing_page(month, pages - 1)
+    if total == 0:
+        return ("В этом месяце нет расходов.", None)
+
+    lines = []
+    for index, expense in enumerate(Expense(*expense) for expense in expenses):
+        lines.append(f"{page * PAGE_SIZE + index + 1}. {expense.category} {expense.money}\n🎇 Описание: {expense.description}\n🗓 Дата: {expense.date}\n")
+    msg = "".join(lines)[:MAX_MESSAGE_LENGTH]
+
+    if pages == 1:
+        return (msg, None)
+    buttons = [InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"month_page:{month}:{page}")]
+    if page > 0:
+        buttons.insert(0, InlineKeyboardButton("⬅️", callback_data=f"month_page:{month}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"month_page:{month}:{page + 1}"))
+    return (msg, InlineKeyboardMarkup([buttons]))
+
+
+async def handle_month_page(update: Update):
+    """Show another page of the month expenses in place of the current one"""
+    query = update.callback_query
+    command, month, page = query.data.split(":")
+    await query.answer()
+    try:
+        msg, keyboard = await blocking.run(listing_page, month, int(page))
+        await query.edit_message_text(msg, reply_markup=keyboard)
+    except db.MonthParseError:
+        await query.edit_message_text("❌ В этом месяце еще не было расходов.\nФайла не существует")
+    except BadRequest:
+        # Page hasn't changed, e.g. the page counter was pressed
+        pass
+
+
+async def handle_month_query(update: Update):
     """Check message validity, then show all expenses in the current month or 
-    show statistic of the given month"""
+    show statistic of the given month or range of months"""
 
-    # Get all expenses in current month
+    # Get all expenses in current month page by page
     if update.message.text.lower() in ["месяц", "month", "/month"]:
+        month = db.fixed_month(datetime.date.today())
         try:
-            expenses = db.current_month_expenses()
-            expenses = [Expense(*expense) for expense in expenses]
-            msg = ""
-            for index, expense in enumerate(expenses):
-                msg += f"{index+1}. {expense.category} {expense.money}\n🎇 Описание: {expense.description}🗓 Дата: {expense.date}\n"
-            update.message.reply_text(msg)
+            msg, keyboard = await blocking.run(listing_page, month, 0)
+            await update.message.reply_text(msg, reply_markup=keyboard)
         except db.MonthParseError:
-            update.message.reply_text("❌ В этом месяце еще не было расходов.\nФайла не существует")
+            await update.message.reply_text("❌ В этом месяце еще не было расходов.\nФайла не существует")
+        return
+    # Statistic in another currency, every expense at the rate of its day
+    words = update.message.text.split()
+    if len(words) == 3 and words[2].lower() in exchange.currencies and words[2].lower() != "uah":
+        await handle_converted_month(update, words[1], words[2].upper())
         return
-    if not is_valid_month(update.message.text):
-        update.message.reply_text("❌ Ошибка в записи месяца.\nФормат должен быть YYYY.MM")
+    if (period := parse_period(update.message.text)) is None:
+        await update.message.reply_text("❌ Ошибка в записи месяца.\nФормат должен быть YYYY.MM, YYYY.MM-YYYY.MM, YYYY.MM {валюта} или year YYYY")
         return
 
-    # Get statistic and barchart of the given month
-    month = update.message.text.split()[1]
+    # Statistic and charts are rendered by the worker pool while other updates are handled
+    first, last = period
+    await reply_month_report(update, first, last, render.month_report, first, last)
+
+
+async def handle_converted_month(update: Update, month: str, currency: str) -> None:
+    """Make sure rates of every day of the month are known, then render its statistic in the currency"""
+    if not is_valid_month(month):
+        await update.message.reply_text("❌ Ошибка в записи месяца.\nФормат должен быть YYYY.MM {валюта}")
+        return
     try:
-        month_stat = db.month_stat(month)
-    except db.MonthParseError:
-        update.message.reply_text("❌ В данном месяце не было расходов.\nФайла не существует")
+        await rate_history.backfill_month(month)
+    except rates.FETCH_ERRORS:
+        await update.message.reply_text("❌ Ошибка при подключении к API курсов валют. Попробуйте позже.")
+        return
+    # History file or RATES_HISTORY_FIXTURE is missing or unreadable, malformed JSON is a ValueError above
+    except OSError:
+        await update.message.reply_text("❌ Не удалось прочитать историю курсов валют.")
         return
-    except FileNotFoundError:
-        update.message.reply_text("❌ Категории еще не добавлены. Файла на существует.")
 
-    msg = f"""
-Месяц: {month_stat["month"]}
-Всего потрачено: {month_stat["total"]}
-Количество расходов: {month_stat["quantity"]}\n
-Самые большие расходы:
-"""
-    for index, expense in enumerate(month_stat['biggest_expenses']):
-        msg += f"""{index+1}. {expense['category']} {expense['money']}
-🎇 Описание: {expense['description']}
-🗓 Дата: {expense['date']}
-"""
+    await reply_month_report(update, month, month, render.converted_month_report, month, currency)
 
-    db.generate_bar_chart_img(month_stat)
-    update.message.reply_text(msg)
 
-    photo_path = os.path.join(getcwd(), f"{month}.png")
-    update.message.reply_photo(photo=open(photo_path, "rb"))
+async def reply_month_report(update: Update, first: str, last: str, job: Callable, *args) -> None:
+    """Show a placeholder until the report is rendered, then replace it by statistic and barchart
+    of the given month or range of months"""
+    placeholder = await update.message.reply_text("⏳ Отчет готовится…")
+    try:
+        report = await render.run(job, *args)
+    except render.RenderQueueFull:
+        await placeholder.edit_text("❌ Слишком много отчетов в очереди. Попробуйте позже.")
+        return
+    except db.MonthParseError:
+        await placeholder.edit_text("❌ В данном месяце не было расходов.\nФайла не существует")
+        return
+    except FileNotFoundError:
+        await placeholder.edit_text("❌ Категории еще не добавлены. Файла на существует.")
+        return
+    except rates.RatesUnavailable:
+        await placeholder.edit_text("❌ Нет курсов валют за этот месяц.")
+        return
+    # Otherwise the placeholder would hang forever, e.g. if a worker process died
+    except Exception:
+        await placeholder.edit_text("❌ Не удалось построить отчет. Попробуйте позже.")
+        raise
 
-    month_file_path = db.path_of_month(month)
-    update.message.reply_document(document=open(month_file_path, encoding="utf8"))
+    await placeholder.delete()
+    await update.message.reply_text(stat_message(report["stat"]))
+    await update.message.reply_photo(photo=BytesIO(report["bar_chart"]))
 
-    # Delete the png
-    remove(photo_path)
\ No newline at end of file
+    # Single month is sent as a file, range of months gets a month-by-month trend instead
+    if first == last:
+        month_file_path = await blocking.run(db.export_month, first)
+        with open(month_file_path, "rb") as f:
+            await update.message.reply_document(document=f)
+    else:
+        await update.message.reply_photo(photo=BytesIO(report["trend_chart"]))
@@ -0,0 +1,85 @@
+"""
+Columnar cache of closed months for the csv storage.
+
+Past months practically never change, so instead of parsing {YYYY.MM}.csv on every query
+they are compiled into cache/{YYYY.MM}/ as NumPy arrays (category codes instead of strings)
+which are memory-mapped on load. The cache is keyed by modification time and size of the
+month file and its tombstones, and is simply ignored when it's stale.
+"""
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = {
+    "dates": "Дата",
+    "money": "Сумма",
+    "descriptions": "Описание"
+}
+
+
+def path_of_cache(root: str, month: str) -> str:
+    """Getting absolute path to the cache/{month} directory"""
+
+    return os.path.join(root, "cache", month)
+
+
+def source_key(*paths: str) -> list[int]:
+    """Modification time and size of every source file, missing files count as zeros"""
+    key = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            key += [stat.st_mtime_ns, stat.st_size]
+        except FileNotFoundError:
+            key += [0, 0]
+    return key
+
+
+def load(root: str, month: str, key: list[int]) -> pd.DataFrame | None:
+    """Get cached DataFrame of the month or None if there is no cache or it's stale"""
+    cache_dir = path_of_cache(root, month)
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf8") as f:
+            meta = json.load(f)
+        if meta["key"] != key:
+            return None
+
+        arrays = {name: np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode="r") for name in (*COLUMNS, "categories")}
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+    df = pd.DataFrame({column: arrays[name] for name, column in COLUMNS.items()})
+    df["Дата"] = df["Дата"].astype(str)
+    df["Описание"] = df["Описание"].astype(str)
+    df["Сумма"] = df["Сумма"].astype("int64")
+    df["Категория"] = pd.Categorical.from_codes(np.asarray(arrays["categories"]), meta["categories"])
+    return df[["Дата", "Сумма", "Категория", "Описание"]]
+
+
+def store(root: str, month: str, key: list[int], df: pd.DataFrame) -> None:
+    """Compile DataFrame of the month into the cache, it's only a cache, so failing to write it is ignored"""
+    cache_dir = path_of_cache(root, month)
+    temp_dir = f"{cache_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.makedirs(temp_dir, exist_ok=True)
+
+        category = df["Категория"].astype("category")
+        np.save(os.path.join(temp_dir, "dates.npy"), df["Дата"].to_numpy(dtype=str))
+        np.save(os.path.join(temp_dir, "money.npy"), df["Сумма"].to_numpy(dtype="int64"))
+        np.save(os.path.join(temp_dir, "descriptions.npy"), df["Описание"].to_numpy(dtype=str))
+        np.save(os.path.join(temp_dir, "categories.npy"), category.cat.codes.to_numpy(dtype="int16"))
+
+        # Meta is written last, so a cache without it is never considered valid
+        with open(os.path.join(temp_dir, "meta.json"), "w", encoding="utf8") as f:
+            json.dump({"key": key, "categories": list(category.cat.categories)}, f, ensure_ascii=False)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        # Fails with "Directory not empty" if another process has just stored the month too
+        os.replace(temp_dir, cache_dir)
+    except OSError:
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,94 @@
+"""
+Background refresh of exchange rates, so conversions always hit a warm cache.
+
+A single task on the event loop fetches the table of rates (every currency of
+exchange.currencies is derived from it) and sleeps until the next refresh:
+    - shortly before the table goes stale,
+    - later when nobody has converted anything for IDLE_AFTER seconds,
+    - sooner after a failure, backing off exponentially,
+    - never during QUIET_HOURS ("23-7", local time), instead right before they end.
+"""
+import asyncio
+import datetime
+import os
+import time
+
+import rates
+
+
+# Part of the TTL after which the table is refreshed
+REFRESH_AT = 0.9
+MIN_INTERVAL = 60
+RETRY_AFTER = 30
+IDLE_AFTER = 6 * 3600
+IDLE_FACTOR = 4
+# Seconds before the end of quiet hours the table is refreshed at
+PREWAKE = 600
+
+
+def quiet_hours() -> tuple[int, int] | None:
+    """(first hour, last hour exclusive) of QUIET_HOURS or None if it's not set, throw ValueError if it's malformed"""
+    if not (value := os.getenv("QUIET_HOURS", "").strip()):
+        return None
+    parts = value.split("-")
+    if len(parts) != 2 or not all(part.strip().isdigit() and int(part) <= 23 for part in parts):
+        raise ValueError(f"QUIET_HOURS must be two hours from 0 to 23 like \"23-7\", not {value!r}")
+    first, last = parts
+    return (int(first), int(last))
+
+
+def is_quiet(moment: datetime.datetime, hours: tuple[int, int]) -> bool:
+    first, last = hours
+    if first <= last:
+        return first <= moment.hour < last
+    return moment.hour >= first or moment.hour < last
+
+
+def end_of_quiet(moment: datetime.datetime, hours: tuple[int, int]) -> datetime.datetime:
+    """Moment quiet hours containing the given moment end at"""
+    end = moment.replace(hour=hours[1], minute=0, second=0, microsecond=0)
+    if end <= moment:
+        end += datetime.timedelta(days=1)
+    return end
+
+
+def next_delay(table: rates.RateTable | None, failures: int, now: float) -> float:
+    """Seconds until the next refresh"""
+    if failures:
+        delay = min(RETRY_AFTER * 2 ** (failures - 1), rates.ttl())
+    elif table is None:
+        delay = 0
+    else:
+        delay = max(table.fetched_at + rates.ttl() * REFRESH_AT - now, MIN_INTERVAL)
+        # Nobody needs fresh rates, but the table is kept usable for stale-while-revalidate
+        if now - rates.last_used() > IDLE_AFTER:
+            delay = min(delay * IDLE_FACTOR, max(table.fetched_at + rates.ttl() + rates.stale_ttl() / 2 - now, MIN_INTERVAL))
+
+    if (hours := quiet_hours()) is not None:
+        moment = datetime.datetime.fromtimestamp(now + delay)
+        if is_quiet(moment, hours):
+            wake = end_of_quiet(moment, hours).timestamp() - PREWAKE
+            delay = max(delay, wake - now)
+    return delay
+
+
+async def refresh_rates(API_KEY: str) -> None:
+    """Refresh the table forever, starting right away unless the cached table is still fresh"""
+    failures = 0
+    delay = next_delay(rates.load(), failures, time.time())
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            table = await rates.refresh(API_KEY, force=True)
+            failures = 0
+        except rates.FETCH_ERRORS:
+            table = rates.load()
+            failures += 1
+        delay = next_delay(table, failures, time.time())
+
+
+def start(API_KEY: str) -> asyncio.Task:
+    """Run the refreshes on the event loop, the task is never done until it's cancelled"""
+    # Malformed QUIET_HOURS stops the bot right away instead of killing the task on its first refresh
+    quiet_hours()
+    return asyncio.get_running_loop().create_task(refresh_rates(API_KEY), name="prefetch_rates")
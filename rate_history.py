@@ -0,0 +1,134 @@
+"""
+Local store of historical exchange rates.
+
+rates/history.csv keeps "date|currency|rate" lines (units of the currency for one UAH)
+of every supported currency. Today's rates are appended whenever a new table is fetched,
+past days are backfilled in bulk from a history source: the exchange rates API or, if
+RATES_HISTORY_FIXTURE is set, a local JSON file {"YYYY.MM.DD": {"USD": rate, ...}}.
+
+Expenses are converted with one date join of the month against the rates of the currency,
+every expense at the rate of its own day (or the closest known one).
+"""
+import datetime
+import json
+import os
+import threading
+from typing import TYPE_CHECKING
+
+import blocking
+import exchange
+import rates
+from http_client import get_client
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+_lock = threading.Lock()
+
+
+def path_of_history() -> str:
+    """Rates are shared by all data directories, so they are kept next to the bot"""
+    return os.path.join(os.getcwd(), "rates", "history.csv")
+
+
+def tracked(day_rates: dict[str, float]) -> dict[str, float]:
+    """Rates of the supported currencies only"""
+    return {currency.upper(): day_rates[currency.upper()] for currency in exchange.currencies if currency.upper() in day_rates}
+
+
+def append_day(date: str, day_rates: dict[str, float]) -> None:
+    """Remember rates of the day, later lines of the same day win"""
+    path = path_of_history()
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf8") as f:
+            for currency, rate in tracked(day_rates).items():
+                f.write(f"{date}|{currency}|{rate}\n")
+
+
+def known_dates() -> set[str]:
+    try:
+        with open(path_of_history(), "r", encoding="utf8") as f:
+            return {line.split("|", 1)[0] for line in f}
+    except FileNotFoundError:
+        return set()
+
+
+class ApiHistory:
+    """Rates of past days from the exchange rates API"""
+    def __init__(self, API_KEY: str):
+        self.API_KEY = API_KEY
+
+    async def rates_on(self, day: datetime.date) -> dict[str, float]:
+        body = await get_client().get_json(f"{self.API_KEY}/history/{rates.BASE}/{day.year}/{day.month}/{day.day}")
+        if body.get("result") != "success":
+            raise rates.RatesUnavailable(body.get("error-type", "unknown error"))
+        return body["conversion_rates"]
+
+
+class FixtureHistory:
+    """Rates of past days from a local JSON file, for running without the API"""
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf8") as f:
+            self.days: dict[str, dict[str, float]] = json.load(f)
+
+    async def rates_on(self, day: datetime.date) -> dict[str, float]:
+        try:
+            return self.days[day.strftime("%Y.%m.%d")]
+        except KeyError:
+            raise rates.RatesUnavailable(f"No rates for {day} in the fixture")
+
+
+def history_source() -> ApiHistory | FixtureHistory:
+    if path := os.getenv("RATES_HISTORY_FIXTURE"):
+        return FixtureHistory(path)
+    return ApiHistory(os.getenv("EXCHANGE_RATE_API_KEY"))
+
+
+async def backfill(first: datetime.date, last: datetime.date, source: ApiHistory | FixtureHistory | None = None) -> int:
+    """Fetch rates of every day from first to last (not later than today) which aren't known yet, return number of days added"""
+    # Reading and writing the history file (and the fixture) is left to the blocking pool
+    source = source or await blocking.run(history_source)
+    known = await blocking.run(known_dates)
+    added = 0
+    day = first
+    while day <= min(last, datetime.date.today()):
+        if (date := day.strftime("%Y.%m.%d")) not in known:
+            await blocking.run(append_day, date, await source.rates_on(day))
+            added += 1
+        day += datetime.timedelta(days=1)
+    return added
+
+
+async def backfill_month(month: str) -> int:
+    year, month_number = [int(x) for x in month.split(".")]
+    first_day = datetime.date(year, month_number, 1)
+    next_month = (first_day + datetime.timedelta(days=32)).replace(day=1)
+    return await backfill(first_day, next_month - datetime.timedelta(days=1))
+
+
+def rates_frame(currency: str) -> "pd.DataFrame":
+    """Known rates of the currency sorted by date, as columns "date" (datetime) and "rate" """
+    import pandas as pd
+
+    try:
+        df = pd.read_csv(path_of_history(), sep="|", names=["date", "currency", "rate"], dtype={"date": str, "currency": str, "rate": float})
+    except FileNotFoundError:
+        raise rates.RatesUnavailable("Rate history is empty")
+    df = df[df["currency"] == currency.upper()].drop_duplicates("date", keep="last")
+    if df.empty:
+        raise rates.RatesUnavailable(f"No history of {currency}")
+    df["date"] = pd.to_datetime(df["date"], format="%Y.%m.%d")
+    return df[["date", "rate"]].sort_values("date", ignore_index=True)
+
+
+def convert_frame(df: "pd.DataFrame", currency: str) -> "pd.DataFrame":
+    """Add "Курс" and converted "Сумма, {currency}" columns to expenses of a month by one join on the date"""
+    import pandas as pd
+
+    expenses = df.assign(date=pd.to_datetime(df["Дата"], format="%Y.%m.%d")).sort_values("date", kind="stable")
+    merged = pd.merge_asof(expenses, rates_frame(currency), on="date", direction="nearest")
+    merged["Курс"] = merged["rate"]
+    merged[f"Сумма, {currency.upper()}"] = merged["Сумма"] * merged["rate"]
+    return merged.drop(columns=["date", "rate"])
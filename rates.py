@@ -0,0 +1,172 @@
+"""
+Cache of exchange rates.
+
+Instead of asking the API for every pair, one table of all rates against the base currency
+is fetched and every pair is derived from it locally. The table is kept in memory and in
+rates/latest.json, so it survives restarts, and is considered fresh for RATES_TTL seconds.
+
+A stale table is still served for RATES_STALE_TTL more seconds while a new one is fetched
+in the background task (stale-while-revalidate). Older tables are refreshed before replying,
+but if the API is down even those are served rather than nothing.
+"""
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import httpx
+
+import blocking
+import rate_history
+from http_client import CircuitOpen, get_client
+from storage import write_atomically
+
+
+BASE = "UAH"
+
+
+class RatesUnavailable(Exception):
+    """Custom exception to be thrown if there are no rates and the API can't give them"""
+    pass
+
+
+# Everything a failed fetch can end with
+FETCH_ERRORS = (httpx.HTTPError, ValueError, RatesUnavailable, CircuitOpen)
+
+
+class RateTable(NamedTuple):
+    # Currency -> units of it for one unit of the base currency
+    rates: dict[str, float]
+    fetched_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def rate(self, from_currency: str, to_currency: str) -> float:
+        """Units of to_currency for one unit of from_currency"""
+        try:
+            return self.rates[to_currency.upper()] / self.rates[from_currency.upper()]
+        except KeyError:
+            raise RatesUnavailable(f"No rate for {from_currency}/{to_currency}")
+
+
+def ttl() -> float:
+    return float(os.getenv("RATES_TTL", "3600"))
+
+
+def stale_ttl() -> float:
+    return float(os.getenv("RATES_STALE_TTL", "86400"))
+
+
+def path_of_rates() -> str:
+    """Rates are shared by all data directories, so they are kept next to the bot"""
+    return os.path.join(os.getcwd(), "rates", "latest.json")
+
+
+_table: RateTable | None = None
+_table_lock = threading.Lock()
+_fetch_lock = asyncio.Lock()
+# Keeps background refreshes from being garbage collected while they run
+_background: set[asyncio.Task] = set()
+# Day the rates were last added to the history by this process
+_recorded_day: str | None = None
+# Time rates were last asked for by a user, lets the prefetch slow down while nobody converts anything
+_last_used = 0.0
+
+
+def load() -> RateTable | None:
+    """Table from memory or from disk, if there is one"""
+    global _table
+    with _table_lock:
+        if _table is None:
+            try:
+                with open(path_of_rates(), "r", encoding="utf8") as f:
+                    saved = json.load(f)
+                _table = RateTable(saved["rates"], saved["fetched_at"])
+            except (FileNotFoundError, ValueError, KeyError):
+                pass
+        return _table
+
+
+async def fetch(API_KEY: str) -> RateTable:
+    """Get all rates against the base currency from the API and remember them"""
+    global _table, _recorded_day
+    body = await get_client().get_json(f"{API_KEY}/latest/{BASE}")
+    if body.get("result") != "success":
+        raise RatesUnavailable(body.get("error-type", "unknown error"))
+
+    table = RateTable(body["conversion_rates"], time.time())
+    path = path_of_rates()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomically(path, json.dumps(table._asdict()))
+    with _table_lock:
+        _table = table
+
+    # The first table of the day becomes the rate of the day in the history
+    today = datetime.date.today().strftime("%Y.%m.%d")
+    if _recorded_day != today:
+        await blocking.run(rate_history.append_day, today, table.rates)
+        _recorded_day = today
+    return table
+
+
+async def refresh(API_KEY: str, force: bool = False) -> RateTable:
+    """Fetch a new table unless another task has just done it (or it's forced)"""
+    async with _fetch_lock:
+        table = load()
+        if not force and table is not None and table.age < ttl():
+            return table
+        return await fetch(API_KEY)
+
+
+def refresh_in_background(API_KEY: str) -> None:
+    async def run():
+        try:
+            await refresh(API_KEY)
+        except FETCH_ERRORS:
+            pass
+
+    # Only one refresh at a time, others keep serving the stale table
+    if not _fetch_lock.locked():
+        task = asyncio.get_running_loop().create_task(run())
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+async def get_table(API_KEY: str) -> RateTable:
+    """Fresh table if possible, a stale one if it's not too old or the API is down, otherwise throw RatesUnavailable"""
+    global _last_used
+    _last_used = time.time()
+    table = load()
+    if table is not None and table.age < ttl():
+        return table
+    if table is not None and table.age < ttl() + stale_ttl():
+        refresh_in_background(API_KEY)
+        return table
+
+    try:
+        return await refresh(API_KEY)
+    except FETCH_ERRORS:
+        if table is not None:
+            return table
+        raise RatesUnavailable("API is down and no rates are cached")
+
+
+def last_used() -> float:
+    return _last_used
+
+
+def freshness(table: RateTable) -> str:
+    """How long ago the rates were fetched, in words"""
+    minutes = int(table.age // 60)
+    if minutes < 1:
+        return "🕒 Курс обновлен только что"
+    if minutes < 60:
+        return f"🕒 Курс обновлен {minutes} мин. назад"
+    if minutes < 48 * 60:
+        return f"🕒 Курс обновлен {minutes // 60} ч. назад"
+    return f"🕒 Курс обновлен {minutes // (24 * 60)} дн. назад"
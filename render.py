@@ -0,0 +1,103 @@
+"""
+Worker pool for month reports.
+
+Reading expenses and drawing charts is done in separate processes, so a slow report doesn't
+block quick messages behind it. Number of reports being rendered or waiting for a worker
+is bounded, new reports are rejected while the queue is full. Every job is given the data
+directory of the user who asked for it, workers keep a few of them open like the bot does.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+import db
+import users
+from storage import data_root
+
+
+MAX_WORKERS = 2
+MAX_QUEUED = 8
+
+
+class RenderQueueFull(Exception):
+    """Custom exception to be thrown if there are too many reports waiting for a worker"""
+    pass
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_WORKERS + MAX_QUEUED)
+
+
+def executor() -> ProcessPoolExecutor:
+    """Get the pool, starting it on the first report"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers are spawned instead of forked, so they never inherit locks held by handler threads
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def month_report(first: str, last: str) -> dict:
+    """Statistic and charts of the period, runs in a worker process"""
+    import charts
+
+    if first == last:
+        stat = db.month_stat(first)
+    else:
+        stat = db.range_stat(first, last)
+
+    return {
+        "stat": stat,
+        "bar_chart": charts.bar_chart(stat),
+        "trend_chart": charts.trend_chart(stat) if first != last else None
+    }
+
+
+def converted_month_report(month: str, currency: str) -> dict:
+    """Statistic and barchart of the month in another currency, runs in a worker process"""
+    import charts
+
+    stat = db.converted_month_stat(month, currency)
+    return {
+        "stat": stat,
+        "bar_chart": charts.bar_chart(stat),
+        "trend_chart": None
+    }
+
+
+def balance_chart(month: str, daily: dict[str, int]) -> bytes:
+    """Line chart of the balance at the end of every day, runs in a worker process"""
+    import charts
+    return charts.balance_chart(month, daily)
+
+
+def warm_up() -> None:
+    """Import heavy libraries in a worker process, so the first report doesn't pay for them"""
+    # Imported only to be loaded into the worker, nothing of them is used here
+    import charts  # noqa: F401
+    import month_cache  # noqa: F401
+
+
+def in_data_root(root: str, job: Callable, *args) -> Any:
+    """Run the job in a session of the data directory, runs in a worker process"""
+    with users.session(root):
+        return job(*args)
+
+
+async def run(job: Callable, *args) -> Any:
+    """Queue the job or throw RenderQueueFull, then wait for its result without blocking the event loop"""
+    if not _slots.acquire(blocking=False):
+        raise RenderQueueFull
+
+    try:
+        future = executor().submit(in_data_root, data_root(), job, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # The slot is taken until the worker is done, even if nobody waits for the result anymore
+    future.add_done_callback(lambda future: _slots.release())
+    return await asyncio.wrap_future(future)
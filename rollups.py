@@ -0,0 +1,206 @@
+"""
+Per-month rollups of expenses: total, quantity, sum and count of every category
+and the five biggest expenses.
+
+They are updated incrementally on every added and deleted expense, so month statistic
+doesn't need to read the expenses themselves. Rollups are kept in rollups/{YYYY.MM}.json
+of the data directory and can always be rebuilt from the expenses.
+"""
+import heapq
+import json
+import os
+import threading
+
+from storage import FileLock, MonthParseError, data_root, get_storage, write_atomically
+
+
+BIGGEST = 5
+
+# One lock per month, so rollups of different months can be rebuilt in parallel.
+# It also locks rollups/{YYYY.MM}.json.lock, render workers update rollups in other processes
+_locks: dict[str, FileLock] = {}
+_locks_lock = threading.Lock()
+
+# Loaded rollups by path with the modification time of their file
+_cache: dict[str, tuple[float, dict]] = {}
+
+
+def path_of_rollup(month: str) -> str:
+    """Getting absolute path to the rollups/{month}.json file"""
+
+    return os.path.join(data_root(), "rollups", month + ".json")
+
+
+def lock_of(month: str) -> FileLock:
+    path = path_of_rollup(month)
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = FileLock(path + ".lock")
+        return _locks[path]
+
+
+def empty_rollup() -> dict:
+    return {
+        "total": 0,
+        "quantity": 0,
+        # Increasing number of every expense, breaks ties between equal biggest expenses
+        "seq": 0,
+        "categories": {},
+        # Min-heap of [money, -seq, date, category, description]
+        "biggest": [],
+        # False when one of the biggest expenses was deleted and the next one is unknown
+        "complete": True
+    }
+
+
+def push_biggest(rollup: dict, money: int, date: str, category: str, description: str) -> None:
+    """Keep the expense if it's one of the biggest in the month"""
+    entry = [money, -rollup["seq"], date, category, description]
+    if len(rollup["biggest"]) < BIGGEST:
+        heapq.heappush(rollup["biggest"], entry)
+    else:
+        heapq.heappushpop(rollup["biggest"], entry)
+
+
+def save(month: str, rollup: dict) -> None:
+    path = path_of_rollup(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomically(path, json.dumps(rollup, ensure_ascii=False))
+    _cache[path] = (os.stat(path).st_mtime, rollup)
+
+
+def rebuild(month: str) -> dict:
+    """Recompute the rollup from all expenses of the month (throw MonthParseError if there are none)"""
+    with lock_of(month):
+        df = get_storage().month_frame(month)
+
+        rollup = empty_rollup()
+        rollup["total"] = int(df["Сумма"].sum())
+        rollup["quantity"] = rollup["seq"] = len(df)
+
+        totals = df.groupby("Категория", observed=True)["Сумма"].agg(["sum", "count"])
+        rollup["categories"] = {
+            category: {"sum": int(row["sum"]), "count": int(row["count"])}
+            for category, row in totals.iterrows()
+        }
+
+        # Position in the month is used as seq, so earlier expenses win ties as before
+        biggest = df.reset_index(drop=True).nlargest(BIGGEST, "Сумма")
+        rollup["biggest"] = [
+            [int(row.Сумма), -position, row.Дата, row.Категория, row.Описание]
+            for position, row in zip(biggest.index, biggest.itertuples(index=False))
+        ]
+        heapq.heapify(rollup["biggest"])
+
+        save(month, rollup)
+        return rollup
+
+
+def get_rollup(month: str) -> dict:
+    """Get the rollup of the month, rebuilding it if it doesn't exist or is incomplete"""
+    path = path_of_rollup(month)
+    with lock_of(month):
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return rebuild(month)
+
+        # Rollup file could be updated by another process
+        if (cached := _cache.get(path)) is not None and cached[0] == mtime:
+            rollup = cached[1]
+        else:
+            with open(path, "r", encoding="utf8") as f:
+                rollup = json.load(f)
+            _cache[path] = (mtime, rollup)
+
+        if not rollup["complete"]:
+            return rebuild(month)
+        return rollup
+
+
+def ensure_rollup(month: str) -> None:
+    """Load or create the rollup before the expenses of the month change"""
+    with lock_of(month):
+        try:
+            get_rollup(month)
+        except MonthParseError:
+            save(month, empty_rollup())
+
+
+def add_expense(month: str, expense) -> None:
+    add_expenses(month, [expense])
+
+
+def add_expenses(month: str, expenses: list) -> None:
+    """Count the expenses in the rollup, it's saved once for all of them"""
+    with lock_of(month):
+        rollup = get_rollup(month)
+
+        for expense in expenses:
+            rollup["total"] += expense.money
+            rollup["quantity"] += 1
+            rollup["seq"] += 1
+            category = rollup["categories"].setdefault(expense.category, {"sum": 0, "count": 0})
+            category["sum"] += expense.money
+            category["count"] += 1
+            push_biggest(rollup, expense.money, expense.date, expense.category, expense.description)
+
+        save(month, rollup)
+
+
+def delete_expense(month: str, expense: dict) -> None:
+    with lock_of(month):
+        rollup = get_rollup(month)
+
+        rollup["total"] -= expense["money"]
+        rollup["quantity"] -= 1
+        category = rollup["categories"][expense["category"]]
+        category["sum"] -= expense["money"]
+        category["count"] -= 1
+        if category["count"] == 0:
+            del rollup["categories"][expense["category"]]
+
+        # Removing the expense from the biggest ones, the next biggest is only known after a rebuild
+        key = [expense["money"], expense["date"], expense["category"], expense["description"]]
+        for i, entry in enumerate(rollup["biggest"]):
+            if [entry[0], *entry[2:]] == key:
+                rollup["biggest"].pop(i)
+                heapq.heapify(rollup["biggest"])
+                if rollup["quantity"] > len(rollup["biggest"]):
+                    rollup["complete"] = False
+                break
+
+        save(month, rollup)
+
+
+def discard(month: str) -> None:
+    """Forget the rollup, e.g. after a failed update, so it's rebuilt from the expenses"""
+    path = path_of_rollup(month)
+    with lock_of(month):
+        _cache.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def rebuild_all() -> list[str]:
+    """Rebuild rollups of every month that has expenses"""
+    months = []
+    for month in get_storage().months():
+        try:
+            rebuild(month)
+            months.append(month)
+        except MonthParseError:
+            continue
+    return months
+
+
+def evict(root: str) -> None:
+    """Forget loaded rollups and locks of the data directory"""
+    prefix = os.path.join(root, "rollups") + os.sep
+    with _locks_lock:
+        for path in [path for path in _locks if path.startswith(prefix)]:
+            del _locks[path]
+        for path in [path for path in _cache if path.startswith(prefix)]:
+            del _cache[path]
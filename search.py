@@ -0,0 +1,77 @@
+from typing import NamedTuple
+from telegram import Update
+
+import blocking
+import search_index
+from month import is_valid_month
+
+
+# Expenses shown in a reply, the rest are only counted
+MAX_SHOWN = 20
+
+
+class InvalidSearchQuery(Exception):
+    """Custom exception to be thrown in case of an invalid search query"""
+    pass
+
+
+class SearchQuery(NamedTuple):
+    prefixes: list[str]
+    first_month: str = "0000.00"
+    last_month: str = "9999.99"
+    min_money: int | None = None
+    max_money: int | None = None
+
+
+def parse_search_query(message: str) -> SearchQuery:
+    """
+    Split the query into words and filters. Examples:\n
+    \"find такси\" -> expenses with words starting with \"такси\",\n
+    \"find кафе >100 <500\" -> only expenses from 100 to 500,\n
+    \"find еда 2022.01-2022.03\" -> only expenses from the given months,\n
+    \"find еда 2022\" -> only expenses from the given year
+    """
+    words = message.split()[1:]
+    if not words:
+        raise InvalidSearchQuery
+
+    prefixes = []
+    filters = {}
+    for word in words:
+        first, sep, last = word.partition("-")
+        try:
+            if word[0] == ">":
+                filters["min_money"] = int(word[1:])
+            elif word[0] == "<":
+                filters["max_money"] = int(word[1:])
+            elif len(word) == 4 and word.isdigit():
+                filters["first_month"], filters["last_month"] = f"{word}.01", f"{word}.12"
+            elif is_valid_month(first) and (not sep or is_valid_month(last)):
+                filters["first_month"], filters["last_month"] = first, last if sep else first
+            else:
+                prefixes.extend(search_index.tokenize(word))
+        except ValueError:
+            raise InvalidSearchQuery
+
+    return SearchQuery(prefixes, **filters)
+
+
+async def handle_search(update: Update) -> None:
+    """Reply with the newest expenses matching all words of the query"""
+    try:
+        query = parse_search_query(update.message.text)
+        found = await blocking.run(lambda: search_index.get_index().search(*query))
+
+        if not found:
+            await update.message.reply_text("🔎 Ничего не найдено")
+            return
+
+        lines = [f"🔎 Найдено: {len(found)}, на сумму {sum(doc[2] for doc in found)} грн\n"]
+        for index, (month, date, money, category, description) in enumerate(found[:MAX_SHOWN]):
+            lines.append(f"{index+1}. {category} {money}\n🎇 Описание: {description}\n🗓 Дата: {date}\n")
+        if len(found) > MAX_SHOWN:
+            lines.append(f"... и еще {len(found) - MAX_SHOWN}")
+        await update.message.reply_text("".join(lines))
+
+    except InvalidSearchQuery:
+        await update.message.reply_text("❌ Ошибка в записи запроса. Должно быть:\nfind {слова} [>{от}] [<{до}] [YYYY.MM-YYYY.MM]")
@@ -0,0 +1,318 @@
+"""
+Inverted index over categories and descriptions of all expenses.
+
+The index is kept in memory and persisted to search/ of the data directory as a snapshot
+plus an append-only log of added and deleted expenses, which is replayed on load. If there
+is no snapshot, the index is built from all months.
+
+The snapshot keeps the postings next to the documents, so loading it is a plain deserialize
+without tokenizing every description again. Once the log grows, it's folded into a new
+snapshot in the blocking pool: the log is moved aside to log.folding.jsonl and the index
+is copied under the lock, the snapshot is serialized and written after it's released.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+
+import blocking
+from storage import MonthParseError, data_root, get_storage, write_atomically
+
+
+# Log entries after which a new snapshot is written
+SNAPSHOT_EVERY = 1000
+
+# Documents or words serialized at once when folding, json.dumps holds the GIL until it's done
+DUMP_CHUNK = 5000
+
+# Memory taken by a document with its postings and key, measured roughly
+BYTES_PER_DOC = 1024
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase words of the text"""
+    return re.findall(r"\w+", text.lower())
+
+
+class SearchIndex:
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.RLock()
+
+        # Document id -> [month, date, money, category, description]
+        self.docs: dict[int, list] = {}
+        # Word -> ids of documents containing it, words are also kept sorted for prefix matching
+        self.postings: dict[str, set[int]] = {}
+        self.words: list[str] = []
+        # (month, date, money, category, description) -> ids, to find the document of a deleted expense,
+        # built on first delete, so loading doesn't pay for it
+        self._keys: dict[tuple, list[int]] | None = None
+        self.next_id = 1
+        self.log_length = 0
+        # Whether the log is being folded into a new snapshot
+        self._folding = False
+
+        self.load()
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.root, "search", "index.json")
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.root, "search", "log.jsonl")
+
+    @property
+    def folding_log_path(self) -> str:
+        return os.path.join(self.root, "search", "log.folding.jsonl")
+
+    @property
+    def keys(self) -> dict[tuple, list[int]]:
+        if self._keys is None:
+            self._keys = {}
+            for doc_id, doc in self.docs.items():
+                self._keys.setdefault(tuple(doc), []).append(doc_id)
+        return self._keys
+
+    def insert(self, doc_id: int, doc: list) -> None:
+        self.docs[doc_id] = doc
+        if self._keys is not None:
+            self._keys.setdefault(tuple(doc), []).append(doc_id)
+        month, date, money, category, description = doc
+        for word in set(tokenize(f"{category} {description}")):
+            if word not in self.postings:
+                self.postings[word] = set()
+                bisect.insort(self.words, word)
+            self.postings[word].add(doc_id)
+        self.next_id = max(self.next_id, doc_id + 1)
+
+    def remove(self, doc_id: int) -> None:
+        doc = self.docs.pop(doc_id)
+        if self._keys is not None:
+            self._keys[tuple(doc)].remove(doc_id)
+            if not self._keys[tuple(doc)]:
+                del self._keys[tuple(doc)]
+        month, date, money, category, description = doc
+        for word in set(tokenize(f"{category} {description}")):
+            self.postings[word].discard(doc_id)
+
+    def load(self) -> None:
+        """Load the snapshot and replay the logs, or build the index from scratch"""
+        # A fold of an evicted instance could replace the snapshot and the logs in between reading them
+        with fold_lock_of(self.root):
+            try:
+                with open(self.snapshot_path, "r", encoding="utf8") as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                self.rebuild()
+                return
+
+            if "postings" in snapshot:
+                self.restore(snapshot)
+            else:
+                # Snapshot of the older format has only documents
+                for doc_id, doc in snapshot["docs"].items():
+                    self.insert(int(doc_id), doc)
+            self.next_id = snapshot["next_id"]
+
+            # Log of an unfinished fold is older than the current one
+            self.replay(self.folding_log_path)
+            self.log_length = self.replay(self.log_path)
+
+    def restore(self, snapshot: dict) -> None:
+        self.docs = dict(zip(snapshot["ids"], snapshot["docs"]))
+        self.postings = {word: set(doc_ids) for word, doc_ids in snapshot["postings"].items()}
+        self.words = sorted(self.postings)
+
+    def replay(self, path: str) -> int:
+        """Apply the log to the index, get the number of its entries"""
+        length = 0
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                for line in f:
+                    length += 1
+                    operation, doc_id, *doc = json.loads(line)
+                    # Entries already in the snapshot are skipped, a fold could stop after writing it
+                    if operation == "+" and doc_id not in self.docs:
+                        self.insert(doc_id, doc)
+                    elif operation == "-" and doc_id in self.docs:
+                        self.remove(doc_id)
+        except FileNotFoundError:
+            pass
+        return length
+
+    def snapshot(self) -> dict:
+        """Copy of the index to be serialized without holding the lock, documents are never changed in place"""
+        return {
+            "next_id": self.next_id,
+            "ids": list(self.docs),
+            "docs": list(self.docs.values()),
+            "postings": {word: list(doc_ids) for word, doc_ids in self.postings.items() if doc_ids}
+        }
+
+    def write_snapshot(self, snapshot: dict) -> None:
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        write_atomically(self.snapshot_path, dump_in_chunks(snapshot))
+
+    def save_snapshot(self) -> None:
+        """Write the whole index into a new snapshot and start an empty log"""
+        with fold_lock_of(self.root), self._lock:
+            self.write_snapshot(self.snapshot())
+            for path in (self.folding_log_path, self.log_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.log_length = 0
+
+    def fold(self) -> None:
+        """Fold the log into a new snapshot, serializing it without holding the lock of the index"""
+        try:
+            # Only one fold of the data directory at a time, the index could be evicted and loaded again meanwhile
+            with fold_lock_of(self.root):
+                with self._lock:
+                    if os.path.exists(self.log_path):
+                        if os.path.exists(self.folding_log_path):
+                            # Left by a fold that never finished, its entries are in the index already
+                            with open(self.log_path, "r", encoding="utf8") as log, open(self.folding_log_path, "a", encoding="utf8") as f:
+                                f.write(log.read())
+                            os.remove(self.log_path)
+                        else:
+                            os.replace(self.log_path, self.folding_log_path)
+                    self.log_length = 0
+                    snapshot = self.snapshot()
+
+                # Rebuilds wait for the fold lock, so no newer snapshot can be written meanwhile
+                self.write_snapshot(snapshot)
+                if os.path.exists(self.folding_log_path):
+                    os.remove(self.folding_log_path)
+        finally:
+            self._folding = False
+
+    def rebuild(self) -> None:
+        """Build the index from expenses of every month"""
+        with fold_lock_of(self.root), self._lock:
+            self.docs, self.postings, self.words, self._keys = {}, {}, [], None
+            self.next_id = 1
+            for month in get_storage().months():
+                try:
+                    rows = get_storage().month_rows(month)
+                except MonthParseError:
+                    continue
+                for date, money, category, description in rows:
+                    self.insert(self.next_id, [month, date, int(money), category, description])
+            self.save_snapshot()
+
+    def append_log(self, *entries: list) -> None:
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, "a", encoding="utf8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self.log_length += len(entries)
+        # Folding takes a while on big indexes, so the handler doesn't wait for it
+        if self.log_length >= SNAPSHOT_EVERY and not self._folding:
+            self._folding = True
+            blocking.pool().submit(self.fold)
+
+    def add_expense(self, month: str, expense) -> None:
+        self.add_expenses(month, [expense])
+
+    def add_expenses(self, month: str, expenses: list) -> None:
+        with self._lock:
+            entries = []
+            for expense in expenses:
+                doc = [month, expense.date, expense.money, expense.category, expense.description]
+                doc_id = self.next_id
+                self.insert(doc_id, doc)
+                entries.append(["+", doc_id, *doc])
+            self.append_log(*entries)
+
+    def delete_expense(self, month: str, expense: dict) -> None:
+        with self._lock:
+            key = (month, expense["date"], expense["money"], expense["category"], expense["description"])
+            if not (doc_ids := self.keys.get(key)):
+                return
+            doc_id = doc_ids[-1]
+            self.remove(doc_id)
+            self.append_log(["-", doc_id])
+
+    def matching(self, prefix: str) -> set[int]:
+        """Ids of documents containing any word that starts with the prefix"""
+        doc_ids = set()
+        start = bisect.bisect_left(self.words, prefix)
+        for word in self.words[start:]:
+            if not word.startswith(prefix):
+                break
+            doc_ids |= self.postings[word]
+        return doc_ids
+
+    def search(self, prefixes: list[str], first_month: str = "0000.00", last_month: str = "9999.99",
+               min_money: int | None = None, max_money: int | None = None) -> list[list]:
+        """Documents containing all the prefixes and passing the filters, newest first"""
+        with self._lock:
+            if prefixes:
+                # Starting from the rarest prefix keeps intersections small
+                candidates = sorted((self.matching(prefix) for prefix in prefixes), key=len)
+                doc_ids = set.intersection(*candidates)
+            else:
+                doc_ids = set(self.docs)
+
+            found = []
+            for doc_id in doc_ids:
+                month, date, money, category, description = doc = self.docs[doc_id]
+                if not (first_month <= month <= last_month):
+                    continue
+                if (min_money is not None and money < min_money) or (max_money is not None and money > max_money):
+                    continue
+                found.append((date, doc_id, doc))
+
+        return [doc for date, doc_id, doc in sorted(found, reverse=True)]
+
+
+def dump_in_chunks(snapshot: dict) -> str:
+    """JSON of the snapshot made of small dumps, so threads of handlers get the GIL in between"""
+    fields = []
+    for name, value in snapshot.items():
+        if isinstance(value, list):
+            chunks = (json.dumps(value[i:i + DUMP_CHUNK], ensure_ascii=False)[1:-1] for i in range(0, len(value), DUMP_CHUNK))
+            fields.append(f'"{name}": [{", ".join(chunks)}]')
+        elif isinstance(value, dict):
+            items = list(value.items())
+            chunks = (json.dumps(dict(items[i:i + DUMP_CHUNK]), ensure_ascii=False)[1:-1] for i in range(0, len(items), DUMP_CHUNK))
+            fields.append(f'"{name}": {{{", ".join(chunks)}}}')
+        else:
+            fields.append(f'"{name}": {json.dumps(value)}')
+    return "{" + ", ".join(fields) + "}"
+
+
+# One index per data directory
+_indexes: dict[str, SearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+# Taken before the lock of the index by anything writing a snapshot, kept after evict
+_fold_locks: dict[str, threading.RLock] = {}
+_fold_locks_lock = threading.Lock()
+
+
+def fold_lock_of(root: str) -> threading.RLock:
+    with _fold_locks_lock:
+        return _fold_locks.setdefault(root, threading.RLock())
+
+
+def get_index() -> SearchIndex:
+    """Get search index of the current data directory, loading it on first use"""
+    root = data_root()
+    with _indexes_lock:
+        if (index := _indexes.get(root)) is None:
+            index = _indexes[root] = SearchIndex(root)
+    return index
+
+
+def footprint(root: str) -> int:
+    """Approximate bytes of memory held by the loaded index of the data directory"""
+    index = _indexes.get(root)
+    return len(index.docs) * BYTES_PER_DOC if index is not None else 0
+
+
+def evict(root: str) -> None:
+    """Forget the loaded index of the data directory, it's loaded from disk again on next use"""
+    with _indexes_lock:
+        _indexes.pop(root, None)
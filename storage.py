@@ -0,0 +1,659 @@
+"""
+Storage backends of the bot.
+
+Both backends keep expenses, balance and categories and expose the same methods,
+so handlers work unchanged on either of them:
+    CsvStorage    -> expenses/{YYYY.MM}.csv, balance.txt and categories.json in the data directory
+    SqliteStorage -> a single SQLite file in WAL mode
+
+The backend is chosen by the STORAGE_BACKEND environment variable ("csv" by default or "sqlite"),
+path to the SQLite file is taken from SQLITE_PATH ("wallet.db" in the data directory by default).
+Only the owner's file can be anywhere, users of the team keep a file of that name in their own directory.
+
+Every user has a data directory of their own (see users.py), the one of the update being
+handled is kept in the current_root context variable.
+"""
+import contextvars
+import datetime
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from array import array
+from typing import BinaryIO, TYPE_CHECKING
+
+# pandas (and the columnar cache built on it) is imported on first use
+# to keep bot startup fast, it's only needed for statistic
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+HEADERS = "Номер|Дата|Сумма|Категория|Описание\n"
+
+# Compact dtypes of month DataFrames: integer money and categorical category
+FRAME_DTYPES = {"Дата": str, "Сумма": "int64", "Категория": "category", "Описание": str}
+
+
+class MonthParseError(Exception):
+    """Custom exception to be thrown if requsted {month}.csv file doesn't exist"""
+    pass
+
+
+def fixed_month(date: datetime.date) -> str:
+    """Replace the "-" by "." in date and cut the day to leave only YYYY.MM"""
+
+    return ".".join(str(date).split("-")[:2])
+
+
+# Data directory of the user whose update is being handled, None means the working directory
+current_root: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_root", default=None)
+
+
+def data_root() -> str:
+    """Getting absolute path to the directory with all the data files"""
+
+    return current_root.get() or os.getcwd()
+
+
+def path_of_month(month: str) -> str:
+    """Getting absolute path to the {month}.csv file"""
+
+    return os.path.join(data_root(), "expenses", month + ".csv")
+
+
+def write_atomically(path: str, text: str) -> None:
+    """Write to a temporary file first, so readers never see a half-written file"""
+    # Temporary file of every writer is its own, render workers write the same files in other processes
+    temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(temp_path, "w", encoding="utf8") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class FileLock:
+    """Reentrant lock of the threads of this process that also locks the file for other processes"""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd: int | None = None
+
+    def __enter__(self) -> "FileLock":
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+class CsvStorage:
+    """
+    Pipe-separated {YYYY.MM}.csv file per month, balance.txt and categories.json.
+    Deleted expenses are only marked in {YYYY.MM}.del and physically removed by compaction.
+    """
+    COMPACTION_THRESHOLD = 32
+
+    def __init__(self, root: str):
+        self.root = root
+
+        # Guards month files against the background compaction thread
+        self._lock = threading.RLock()
+
+        # Open append handles and next "Номер" of month files touched by this process
+        self._month_files: dict[str, BinaryIO] = {}
+        self._next_index: dict[str, int] = {}
+
+        # Byte offsets of rows not marked as deleted, so any of them can be read by a single seek
+        self._offsets: dict[str, array] = {}
+
+    def path_of_month(self, month: str) -> str:
+        """Getting absolute path to the {month}.csv file"""
+
+        return os.path.join(self.root, "expenses", month + ".csv")
+
+    def path_of_tombstones(self, month: str) -> str:
+        """Getting absolute path to the {month}.del file next to the {month}.csv file"""
+
+        return os.path.join(self.root, "expenses", month + ".del")
+
+    def read_tombstones(self, month: str) -> set[int]:
+        """Get "Номер" of every deleted but not yet compacted expense of the month"""
+        try:
+            with open(self.path_of_tombstones(month), "r", encoding="utf8") as f:
+                return {int(line) for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def months(self) -> list[str]:
+        """All months that have expenses, in chronological order"""
+        try:
+            names = os.listdir(os.path.join(self.root, "expenses"))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith(".csv"))
+
+    @staticmethod
+    def last_index_of(month_file_path: str) -> int:
+        """Get "Номер" of the last expense by reading the file backwards from its end"""
+        with open(month_file_path, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            tail = b""
+            # Reading blocks from the end until the whole last line is in the tail
+            while position > 0 and tail.rstrip(b"\n").count(b"\n") == 0:
+                step = min(1024, position)
+                position -= step
+                f.seek(position)
+                tail = f.read(step) + tail
+        last_line = tail.rstrip(b"\n").rsplit(b"\n", 1)[-1].decode("utf8")
+        last_number = last_line.split("|")[0]
+        return int(last_number) if last_number.isdigit() else 0
+
+    def open_month_file(self, month: str) -> BinaryIO:
+        """Get the cached append handle of a month file, opening it once per process"""
+        if (f := self._month_files.get(month)) is not None:
+            return f
+
+        # Only one month is written to at a time, so handles of previous months are closed
+        for other_month in list(self._month_files):
+            self.forget_month_file(other_month)
+
+        # Creating {month}.csv file if it doesn't exist yet and add the headers
+        month_file_path = self.path_of_month(month)
+        if not os.path.exists(month_file_path):
+            os.makedirs(os.path.dirname(month_file_path), exist_ok=True)
+            with open(month_file_path, "a", encoding="utf8") as f:
+                f.write(HEADERS)
+            self._next_index[month] = 1
+        else:
+            self._next_index[month] = self.last_index_of(month_file_path) + 1
+
+        # Opened in binary mode, so the position of every appended row is known
+        f = open(month_file_path, "ab")
+        self._month_files[month] = f
+        return f
+
+    def forget_month_file(self, month: str) -> None:
+        """Drop every cached state of a month file, must be called whenever the file is rewritten"""
+        if (f := self._month_files.pop(month, None)) is not None:
+            f.close()
+        self._next_index.pop(month, None)
+        self._offsets.pop(month, None)
+
+    def offsets_of(self, month: str) -> array:
+        """Get byte offsets of the month rows without the deleted ones (throw MonthParseError if no file)"""
+        if (offsets := self._offsets.get(month)) is not None:
+            return offsets
+
+        tombstones = self.read_tombstones(month)
+        offsets = array("q")
+        try:
+            with open(self.path_of_month(month), "rb") as f:
+                # Skip headers (first line)
+                position = len(f.readline())
+                for line in f:
+                    if int(line.split(b"|", 1)[0]) not in tombstones:
+                        offsets.append(position)
+                    position += len(line)
+        except FileNotFoundError:
+            raise MonthParseError
+
+        self._offsets[month] = offsets
+        return offsets
+
+    @staticmethod
+    def read_row(f: BinaryIO, offset: int) -> list[str]:
+        """Read ["Номер", date, money, category, description] of the row starting at offset"""
+        f.seek(offset)
+        return f.readline().decode("utf8").rstrip("\n").split("|", 4)
+
+    def add_expense(self, month: str, expense) -> None:
+        """Append expense to the {month}.csv file"""
+        self.add_expenses(month, [expense])
+
+    def add_expenses(self, month: str, expenses: list) -> None:
+        """Append expenses to the {month}.csv file with a single write"""
+        with self._lock:
+            f = self.open_month_file(month)
+            first_index = self._next_index[month]
+
+            # Every expense in following format: "...|...|...|...|..."
+            lines = []
+            for new_index, expense in enumerate(expenses, start=first_index):
+                full_list = [str(x) for x in (new_index, expense.date, expense.money, expense.category, expense.description)]
+                lines.append(("|".join(full_list) + "\n").encode("utf8"))
+
+            offset = f.tell()
+            f.write(b"".join(lines))
+            f.flush()
+            self._next_index[month] = first_index + len(expenses)
+
+            if (offsets := self._offsets.get(month)) is not None:
+                for line in lines:
+                    offsets.append(offset)
+                    offset += len(line)
+
+    def delete_expense(self, month: str, index: int) -> dict:
+        """
+        Delete expense by its index in the month (-1 for the last one).
+        Only a tombstone is appended here, the file is compacted in the background.
+        """
+        with self._lock:
+            offsets = self.offsets_of(month)
+            if index > len(offsets) or len(offsets) == 0:
+                raise ValueError
+
+            offset = offsets.pop(index - 1 if index > 0 else -1)
+            with open(self.path_of_month(month), "rb") as f:
+                number, date, money, category, description = self.read_row(f, offset)
+
+            with open(self.path_of_tombstones(month), "a", encoding="utf8") as f:
+                f.write(f"{number}\n")
+
+            # Enough tombstones piled up, rewriting the file without blocking the handler
+            if len(self.read_tombstones(month)) >= self.COMPACTION_THRESHOLD:
+                threading.Thread(target=self.compact_month, args=(month,), daemon=True).start()
+
+        return {
+            "date": date,
+            "money": int(money),
+            "category": category,
+            "description": description
+        }
+
+    def compact_month(self, month: str) -> None:
+        """Rewrite the month file without deleted expenses and renumber the rest"""
+        with self._lock:
+            tombstones = self.read_tombstones(month)
+            if not tombstones:
+                return
+
+            month_file_path = self.path_of_month(month)
+            with open(month_file_path, "r", encoding="utf8") as f:
+                headers = next(f)
+                lines = [line for line in f if int(line.split("|", 1)[0]) not in tombstones]
+
+            text = headers + "".join(f"{number}|{line.split('|', 1)[1]}" for number, line in enumerate(lines, start=1))
+            self.forget_month_file(month)
+            write_atomically(month_file_path, text)
+            os.remove(self.path_of_tombstones(month))
+
+    def month_rows(self, month: str) -> list[list[str]]:
+        """Get all expenses of the month as [date, money, category, description] lists"""
+        rows = []
+        # Month file and its tombstones must not be compacted in between reading them
+        with self._lock:
+            tombstones = self.read_tombstones(month)
+            try:
+                with open(self.path_of_month(month), "r", encoding="utf8") as f:
+                    # Skip headers (first line)
+                    next(f)
+                    for line in f:
+                        number, *expense_attributes_list = line.rstrip("\n").split("|", 4)
+                        if int(number) not in tombstones:
+                            rows.append(expense_attributes_list)
+            except FileNotFoundError:
+                raise MonthParseError
+        return rows
+
+    def month_page(self, month: str, start: int, count: int) -> tuple[list[list[str]], int]:
+        """
+        Get [date, money, category, description] lists of count expenses from start
+        and the total number of expenses in the month
+        """
+        with self._lock:
+            offsets = self.offsets_of(month)
+            rows = []
+            with open(self.path_of_month(month), "rb") as f:
+                for offset in offsets[start:start + count]:
+                    number, *expense_attributes_list = self.read_row(f, offset)
+                    rows.append(expense_attributes_list)
+            return rows, len(offsets)
+
+    def month_frame(self, month: str) -> "pd.DataFrame":
+        """
+        Get all expenses of the month as a DataFrame.
+        Closed months are read through the columnar cache and parsed only when it's stale.
+        """
+        import pandas as pd
+        import month_cache
+
+        closed = month < fixed_month(datetime.date.today())
+
+        # Month file and its tombstones must not be compacted in between reading them
+        with self._lock:
+            key = month_cache.source_key(self.path_of_month(month), self.path_of_tombstones(month))
+            if closed and (df := month_cache.load(self.root, month, key)) is not None:
+                return df
+
+            try:
+                # Empty descriptions are kept as "" instead of NaN
+                df = pd.read_csv(self.path_of_month(month), sep="|", dtype={"Номер": "int64", **FRAME_DTYPES}, keep_default_na=False)
+            except FileNotFoundError:
+                raise MonthParseError("Файла не существует")
+            tombstones = self.read_tombstones(month)
+
+        # Skipping deleted expenses which are not compacted yet
+        df = df[~df["Номер"].isin(tombstones)].drop(columns="Номер")
+        if closed:
+            month_cache.store(self.root, month, key, df)
+        return df
+
+    def replace_month(self, month: str, rows: list[list[str]]) -> None:
+        """Overwrite all expenses of the month by given [date, money, category, description] lists"""
+        with self._lock:
+            month_file_path = self.path_of_month(month)
+            os.makedirs(os.path.dirname(month_file_path), exist_ok=True)
+            text = HEADERS + "".join(f"{number}|{'|'.join(map(str, row))}\n" for number, row in enumerate(rows, start=1))
+            self.forget_month_file(month)
+            write_atomically(month_file_path, text)
+            if os.path.exists(self.path_of_tombstones(month)):
+                os.remove(self.path_of_tombstones(month))
+
+    def export_month(self, month: str) -> str:
+        """Get path to the month in csv layout"""
+        if not os.path.exists(self.path_of_month(month)):
+            raise MonthParseError
+        # Deleted expenses must not get into the exported file
+        self.compact_month(month)
+        return self.path_of_month(month)
+
+    def get_balance(self) -> int:
+        """Getting current balance or throw IOError if file doesn't exist yet"""
+        with open(os.path.join(self.root, "balance.txt"), "r") as f:
+            balance = f.read()
+        return int(balance)
+
+    def set_balance(self, new_balance: int) -> None:
+        """Overriding (or creating) balance by a new value"""
+        with open(os.path.join(self.root, "balance.txt"), "w") as f:
+            f.write(f"{new_balance}")
+
+    def load_categories(self) -> dict[str, list[str]]:
+        """Get all categories with their aliases or throw FileNotFoundError"""
+        with open(os.path.join(self.root, "categories.json"), "r", encoding="utf8") as f:
+            return json.load(f)
+
+    def save_categories(self, categories: dict[str, list[str]]) -> None:
+        """Overwrite (or create) categories.json"""
+        text = json.dumps(categories, indent=4, ensure_ascii=False)
+        write_atomically(os.path.join(self.root, "categories.json"), text)
+
+    def categories_version(self) -> tuple[int, int, int]:
+        """Changes whenever categories.json is rewritten, zeros if it doesn't exist"""
+        try:
+            stat = os.stat(os.path.join(self.root, "categories.json"))
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return (0, 0, 0)
+
+    def footprint(self) -> int:
+        """Approximate bytes of memory held by the cached row offsets"""
+        return sum(offsets.itemsize * len(offsets) for offsets in list(self._offsets.values()))
+
+    def close(self) -> None:
+        with self._lock:
+            for month in list(self._month_files):
+                self.forget_month_file(month)
+
+
+class SqliteStorage:
+    """Single SQLite file in WAL mode, indexed by month, date and category"""
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        month TEXT NOT NULL,
+        date TEXT NOT NULL,
+        money INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS expenses_month ON expenses (month, id);
+    CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date);
+    CREATE INDEX IF NOT EXISTS expenses_category ON expenses (month, category);
+
+    CREATE TABLE IF NOT EXISTS categories (
+        position INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        aliases TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.root = os.path.dirname(path)
+
+        # One connection is shared by all handler threads, so it is guarded by a lock
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA)
+        self._categories_saved = 0
+
+    def months(self) -> list[str]:
+        """All months that have expenses, in chronological order"""
+        with self._lock:
+            cursor = self._connection.execute("SELECT DISTINCT month FROM expenses ORDER BY month")
+            return [month for month, in cursor]
+
+    def add_expense(self, month: str, expense) -> None:
+        self.add_expenses(month, [expense])
+
+    def add_expenses(self, month: str, expenses: list) -> None:
+        """Insert expenses in a single transaction"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO expenses (month, date, money, category, description) VALUES (?, ?, ?, ?, ?)",
+                [(month, expense.date, expense.money, expense.category, expense.description) for expense in expenses]
+            )
+
+    def delete_expense(self, month: str, index: int) -> dict:
+        """Delete expense by its index in the month (-1 for the last one)"""
+        with self._lock, self._connection:
+            if index == -1:
+                cursor = self._connection.execute(
+                    "SELECT id, date, money, category, description FROM expenses "
+                    "WHERE month = ? ORDER BY id DESC LIMIT 1", (month,)
+                )
+            else:
+                cursor = self._connection.execute(
+                    "SELECT id, date, money, category, description FROM expenses "
+                    "WHERE month = ? ORDER BY id LIMIT 1 OFFSET ?", (month, index - 1)
+                )
+            if (row := cursor.fetchone()) is None:
+                if self._connection.execute("SELECT 1 FROM expenses WHERE month = ? LIMIT 1", (month,)).fetchone() is None:
+                    raise MonthParseError
+                raise ValueError
+
+            expense_id, date, money, category, description = row
+            self._connection.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
+
+        return {
+            "date": date,
+            "money": money,
+            "category": category,
+            "description": description
+        }
+
+    def month_rows(self, month: str) -> list[list[str]]:
+        """Get all expenses of the month as [date, money, category, description] lists"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "SELECT date, money, category, description FROM expenses WHERE month = ? ORDER BY id", (month,)
+            )
+            rows = [[date, str(money), category, description] for date, money, category, description in cursor]
+        if not rows:
+            raise MonthParseError
+        return rows
+
+    def month_page(self, month: str, start: int, count: int) -> tuple[list[list[str]], int]:
+        """
+        Get [date, money, category, description] lists of count expenses from start
+        and the total number of expenses in the month
+        """
+        with self._lock:
+            total, = self._connection.execute("SELECT COUNT(*) FROM expenses WHERE month = ?", (month,)).fetchone()
+            cursor = self._connection.execute(
+                "SELECT date, money, category, description FROM expenses WHERE month = ? ORDER BY id LIMIT ? OFFSET ?",
+                (month, count, start)
+            )
+            rows = [[date, str(money), category, description] for date, money, category, description in cursor]
+        if total == 0:
+            raise MonthParseError
+        return rows, total
+
+    def month_frame(self, month: str) -> "pd.DataFrame":
+        """Get all expenses of the month as a DataFrame"""
+        import pandas as pd
+
+        with self._lock:
+            df = pd.read_sql_query(
+                'SELECT date AS "Дата", money AS "Сумма", category AS "Категория", description AS "Описание" '
+                "FROM expenses WHERE month = ? ORDER BY id", self._connection, params=(month,)
+            )
+        if df.empty:
+            raise MonthParseError("Файла не существует")
+        return df.astype(FRAME_DTYPES)
+
+    def replace_month(self, month: str, rows: list[list[str]]) -> None:
+        """Overwrite all expenses of the month by given [date, money, category, description] lists"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM expenses WHERE month = ?", (month,))
+            self._connection.executemany(
+                "INSERT INTO expenses (month, date, money, category, description) VALUES (?, ?, ?, ?, ?)",
+                [(month, date, int(money), category, description) for date, money, category, description in rows]
+            )
+
+    def export_month(self, month: str) -> str:
+        """Write the month in csv layout to exports/{month}.csv and get path to it"""
+        rows = self.month_rows(month)
+        export_path = os.path.join(self.root, "exports", month + ".csv")
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+        write_atomically(export_path, HEADERS + "".join(f"{number}|{'|'.join(row)}\n" for number, row in enumerate(rows, start=1)))
+        return export_path
+
+    def get_balance(self) -> int:
+        """Getting current balance or throw IOError if it isn't set yet"""
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM settings WHERE key = 'balance'").fetchone()
+        if row is None:
+            raise FileNotFoundError("Balance is not set")
+        return int(row[0])
+
+    def set_balance(self, new_balance: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('balance', ?)", (str(new_balance),)
+            )
+
+    def load_categories(self) -> dict[str, list[str]]:
+        """Get all categories with their aliases or throw FileNotFoundError if there are none yet"""
+        with self._lock:
+            rows = self._connection.execute("SELECT name, aliases FROM categories ORDER BY position").fetchall()
+        if not rows:
+            raise FileNotFoundError("Categories are not added yet")
+        return {name: json.loads(aliases) for name, aliases in rows}
+
+    def save_categories(self, categories: dict[str, list[str]]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM categories")
+            self._connection.executemany(
+                "INSERT INTO categories (position, name, aliases) VALUES (?, ?, ?)",
+                [(position, name, json.dumps(aliases, ensure_ascii=False))
+                 for position, (name, aliases) in enumerate(categories.items())]
+            )
+            self._categories_saved += 1
+
+    def categories_version(self) -> tuple[int, int]:
+        """Changes whenever categories are saved by this connection or anything is committed by another one"""
+        with self._lock:
+            data_version, = self._connection.execute("PRAGMA data_version").fetchone()
+            return (data_version, self._categories_saved)
+
+    def footprint(self) -> int:
+        """Page cache of the connection is bounded by SQLite itself"""
+        return 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+# One storage object per data directory, so cached state is shared by all handlers
+_storages: dict[str, CsvStorage | SqliteStorage] = {}
+_storages_lock = threading.Lock()
+
+
+def sqlite_path(root: str) -> str:
+    """Path to the SQLite file of the data directory"""
+    path = os.getenv("SQLITE_PATH", "wallet.db")
+    # An absolute or relative path with directories would make every user of the team share one file
+    if root != os.getcwd():
+        path = os.path.basename(path)
+    return os.path.join(root, path)
+
+
+def open_storage(root: str) -> CsvStorage | SqliteStorage:
+    """Construct storage for the data directory according to STORAGE_BACKEND"""
+    match os.getenv("STORAGE_BACKEND", "csv").lower():
+        case "csv":
+            return CsvStorage(root)
+        case "sqlite":
+            return SqliteStorage(sqlite_path(root))
+        case backend:
+            raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def get_storage() -> CsvStorage | SqliteStorage:
+    """Get storage of the current data directory"""
+    root = data_root()
+    with _storages_lock:
+        if (storage := _storages.get(root)) is None:
+            storage = _storages[root] = open_storage(root)
+    return storage
+
+
+def footprint(root: str) -> int:
+    """Approximate bytes of memory held by the open storage of the data directory"""
+    storage = _storages.get(root)
+    return storage.footprint() if storage is not None else 0
+
+
+def evict(root: str) -> None:
+    """Close storage of the data directory, it's opened again on next use"""
+    with _storages_lock:
+        storage = _storages.pop(root, None)
+    if storage is not None:
+        storage.close()
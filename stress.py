@@ -0,0 +1,126 @@
+"""
+Concurrency stress check of the expense, income and delete handlers.
+Fires many updates at once on the event loop (like the application does with concurrent updates)
+in a temporary directory and checks that balance, expenses, rollups and search index still agree.
+Then another user adds an expense and checks that their statistic doesn't include the owner's.
+
+Usage: python stress.py [updates] [concurrent updates]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import db
+import deleting
+import expenses
+import incomes
+import ledger
+import rollups
+import search_index
+import users
+from balance import set_balance
+
+
+INITIAL_BALANCE = 1_000_000
+
+
+def fake_update(text: str, replies: list) -> SimpleNamespace:
+    """Update with just enough of a message for the handlers"""
+    async def reply_text(reply, **kwargs):
+        replies.append(reply)
+
+    return SimpleNamespace(message=SimpleNamespace(text=text, reply_text=reply_text))
+
+
+async def fire(updates: int, concurrency: int) -> None:
+    random.seed(1)
+    replies = []
+    jobs = []
+    for i in range(updates):
+        kind = random.random()
+        if kind < 0.6:
+            jobs.append((expenses.handle_expense, f"{random.randint(1, 500)} {random.choice(['taxi', 'cafe', 'food'])} stress {i}"))
+        elif kind < 0.75:
+            jobs.append((incomes.handle_income, f"+ {random.randint(1, 500)} stress {i}"))
+        else:
+            jobs.append((deleting.handle_expense_deletion, random.choice(["del last", "del 1", "del 2"])))
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def handle(handler, text):
+        async with slots:
+            await handler(fake_update(text, replies))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle(handler, text) for handler, text in jobs))
+    print(f"{updates} updates, {concurrency} at a time: {time.perf_counter() - start:.1f} s")
+
+
+def check() -> list[str]:
+    """Invariants which hold only if no update was lost or applied halfway"""
+    problems = []
+    month = db.current_month()
+    rows = db.current_month_expenses()
+    spent = sum(int(money) for date, money, category, description in rows)
+
+    book = ledger.get_ledger()
+    try:
+        book.verify()
+    except ledger.LedgerCorrupted as e:
+        problems.append(f"ledger: {e}")
+
+    incomes_total = sum(entry["delta"] for entry in book.entries() if entry["reason"].startswith("income"))
+    if book.balance != INITIAL_BALANCE + incomes_total - spent:
+        problems.append(f"balance {book.balance} != {INITIAL_BALANCE} + {incomes_total} - {spent}")
+
+    rollup = rollups.get_rollup(month)
+    if (rollup["total"], rollup["quantity"]) != (spent, len(rows)):
+        problems.append(f"rollup has {rollup['quantity']} expenses for {rollup['total']}, month has {len(rows)} for {spent}")
+
+    indexed = search_index.get_index().search([], month, month)
+    if sorted(doc[1:] for doc in indexed) != sorted([date, int(money), category, description] for date, money, category, description in rows):
+        problems.append(f"search index has {len(indexed)} expenses of the month, month has {len(rows)}")
+
+    return problems
+
+
+def check_users() -> list[str]:
+    """Statistic of another user counts only their own expenses, never those of the owner (working directory)"""
+    problems = []
+    month = db.current_month()
+    year = month[:4]
+    with users.session(os.path.join(os.getcwd(), "users", "42")):
+        set_balance(INITIAL_BALANCE)
+        asyncio.run(expenses.handle_expense(fake_update("5 taxi other user", [])))
+
+        for name, stat in [("month", db.month_stat(month)), ("range", db.range_stat(f"{year}.01", f"{year}.12"))]:
+            if (stat["total"], stat["quantity"]) != (5, 1):
+                problems.append(f"{name} statistic of another user has {stat['quantity']} expenses for {stat['total']}, expected 1 for 5")
+        if len(search_index.get_index().search([], month, month)) != 1:
+            problems.append("search index of another user has expenses of the owner")
+    return problems
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        set_balance(INITIAL_BALANCE)
+        asyncio.run(fire(updates, concurrency))
+
+        problems = check() + check_users()
+        for problem in problems:
+            print(f"FAILED {problem}")
+        if problems:
+            sys.exit(1)
+        print("OK: balance, expenses, rollups and search index agree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Units of work over several resources of the data directory.
+
+A transaction locks the resources it names ("balance", "month:YYYY.MM", "categories", ...)
+in a fixed order, so handlers running in parallel never deadlock, and collects an undo
+action for every change it makes. If anything inside the transaction throws, the changes
+made so far are undone in reverse order and the exception is passed on, so either every
+change of the unit is kept or none of them is.
+
+Locks are reentrant, so functions opening their own transaction can be called inside
+another one over the same resources.
+"""
+import logging
+import threading
+from typing import Callable
+
+from storage import data_root
+
+
+logger = logging.getLogger(__name__)
+
+_locks: dict[tuple[str, str], threading.RLock] = {}
+_locks_lock = threading.Lock()
+
+
+def lock_of(resource: str) -> threading.RLock:
+    """Lock of the resource in the current data directory"""
+    with _locks_lock:
+        return _locks.setdefault((data_root(), resource), threading.RLock())
+
+
+class Transaction:
+    def __init__(self, *resources: str):
+        self.locks = [lock_of(resource) for resource in sorted(set(resources))]
+        self.undo: list[Callable[[], None]] = []
+
+    def on_rollback(self, undo: Callable[[], None]) -> None:
+        """Remember how to undo the change that was just made"""
+        self.undo.append(undo)
+
+    def __enter__(self) -> "Transaction":
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        try:
+            if exc_type is not None:
+                for undo in reversed(self.undo):
+                    try:
+                        undo()
+                    except Exception:
+                        logger.exception("Rollback step failed")
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
+
+def transaction(*resources: str) -> Transaction:
+    """Start a unit of work holding locks of the resources, used as a context manager"""
+    return Transaction(*resources)
+
+
+def evict(root: str) -> None:
+    """Forget locks of the data directory, nothing may hold them"""
+    with _locks_lock:
+        for key in [key for key in _locks if key[0] == root]:
+            del _locks[key]
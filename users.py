@@ -0,0 +1,122 @@
+"""
+Users of the bot and their data directories.
+
+Only users of the allow-list get replies: TELEGRAM_USER_ID, the owner, whose data stays
+in the working directory as before, and TELEGRAM_USER_IDS, a comma-separated list of the
+team, each with a data directory of their own in USERS_DIR/{user id} ("users" by default).
+Every update is handled in a session of its user, which makes storage.data_root() resolve
+to the user's directory, so paths, storages, ledgers, indexes and locks never mix users.
+
+Stores and caches of a user stay open between updates. Least recently used users are closed
+once more than MAX_OPEN_USERS are open or all caches take more than USERS_CACHE_MB, and are
+reopened from disk on their next update. Users with updates in progress are never closed.
+"""
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterator
+
+import category_index
+import ledger
+import rollups
+import search_index
+import storage
+import transaction
+
+
+def allowed_ids() -> set[int]:
+    ids = {int(user_id) for user_id in os.getenv("TELEGRAM_USER_IDS", "").split(",") if user_id.strip()}
+    if owner := os.getenv("TELEGRAM_USER_ID"):
+        ids.add(int(owner))
+    return ids
+
+
+def is_allowed(user_id: int) -> bool:
+    return user_id in allowed_ids()
+
+
+def users_dir() -> str:
+    return os.path.join(os.getcwd(), os.getenv("USERS_DIR", "users"))
+
+
+def root_of(user_id: int) -> str:
+    """Data directory of the user"""
+    if str(user_id) == os.getenv("TELEGRAM_USER_ID"):
+        return os.getcwd()
+    return os.path.join(users_dir(), str(user_id))
+
+
+def known_roots() -> list[str]:
+    """Data directories of the owner and of every user who has one"""
+    try:
+        names = sorted(os.listdir(users_dir()))
+    except FileNotFoundError:
+        names = []
+    return [os.getcwd(), *(os.path.join(users_dir(), name) for name in names if name.isdigit())]
+
+
+def max_open_users() -> int:
+    return int(os.getenv("MAX_OPEN_USERS", "64"))
+
+
+def cache_limit() -> int:
+    return int(float(os.getenv("USERS_CACHE_MB", "256")) * 2 ** 20)
+
+
+# Open data directories from the least recently used one, with number of sessions in progress
+_open: OrderedDict[str, int] = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def footprint(root: str) -> int:
+    """Approximate bytes of memory held by caches of the data directory"""
+    return storage.footprint(root) + search_index.footprint(root)
+
+
+def close(root: str) -> None:
+    """Drop everything cached for the data directory, files are left as they are"""
+    for module in (search_index, category_index, rollups, transaction, ledger, storage):
+        module.evict(root)
+
+
+def evict_over_limits() -> list[str]:
+    """Close least recently used idle data directories while over the limits, get the closed ones"""
+    closed = []
+    # Closing is done under the lock, so a session can't reopen a directory halfway closed
+    with _open_lock:
+        total = sum(footprint(root) for root in _open)
+        for root in [root for root, sessions in _open.items() if sessions == 0]:
+            if len(_open) <= max_open_users() and total <= cache_limit():
+                break
+            total -= footprint(root)
+            close(root)
+            del _open[root]
+            closed.append(root)
+    return closed
+
+
+@contextlib.contextmanager
+def session(root: str) -> Iterator[str]:
+    """Handle an update in the data directory: keep it open meanwhile and make it the current one"""
+    with _open_lock:
+        if root not in _open:
+            os.makedirs(root, exist_ok=True)
+            _open[root] = 0
+        _open[root] += 1
+        _open.move_to_end(root)
+
+    token = storage.current_root.set(root)
+    try:
+        yield root
+    finally:
+        storage.current_root.reset(token)
+        with _open_lock:
+            _open[root] -= 1
+        evict_over_limits()
+
+
+def stats() -> list[tuple[str, int, int]]:
+    """(data directory, sessions in progress, approximate bytes cached) of open users, least recently used first"""
+    with _open_lock:
+        return [(root, sessions, footprint(root)) for root, sessions in _open.items()]
@@ -1,15 +1,17 @@
-from telegram.update import Update
-from os import getenv
+from telegram import Update
+
+import users
 
 
 def authorize(func):
     """Decorator for all Command and Message handler functions,
-    ensures responding only to given User ID (my)"""
-    def wrapper(update: Update, *args, **kwargs):
-        if update.effective_user.id != int(getenv("TELEGRAM_USER_ID")):
-            update.message.reply_text("Access denied")
+    ensures responding only to allowed users and handles the update in the user's data directory"""
+    async def wrapper(update: Update, *args, **kwargs):
+        if not users.is_allowed(update.effective_user.id):
+            await update.effective_message.reply_text("Access denied")
             return
-        return func(update, *args, **kwargs)
+        with users.session(users.root_of(update.effective_user.id)):
+            return await func(update, *args, **kwargs)
     
     return wrapper
 
@@ -28,12 +30,14 @@ def get_type_of_message(message: str) -> str:
         return "balance"
     if command in ["cv", "convert"]:
         return "exchange_query"
-    if command in ["месяц", "month"]:
+    if command in ["месяц", "month", "год", "year"]:
         return "month"
     if command in ["add", "добавить"]:
         return "add_category"
     if command in ["del", "delete"]:
         try:
+            if message.split()[1].lower() == "last":
+                return "delete_expense"
             int(message.split()[1])
             return "delete_expense"
         except IndexError:
@@ -42,6 +46,8 @@ def get_type_of_message(message: str) -> str:
             return "delete_category"
     if command in ["categories", "категории"]:
         return "categories"
+    if command in ["find", "найти", "поиск"]:
+        return "find"
 
         
     return "nonsense"